@@ -1,22 +1,49 @@
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-from werkzeug.utils import secure_filename
+from quart import Quart, Response, request, jsonify, send_from_directory, abort
+from quart.json.provider import DefaultJSONProvider
+from quart_cors import cors
+from werkzeug.utils import safe_join
+from cachetools import TTLCache
+import asyncio
+import brotli
+import functools
+import gzip
+import hashlib
 import os
 import logging
+import mimetypes
+import orjson
+import re
+import uvicorn
 from contract_analyzer import ContractAnalyzer
 from pdf_processor import PDFProcessor
+from community_data import get_aggregated_stats
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='../frontend')
-CORS(app)
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, used by jsonify() and request.get_json()"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# Initialize Quart app (ASGI, served by Uvicorn)
+app = Quart(__name__, static_folder='../frontend')
+app.json = ORJSONProvider(app)
+app = cors(app)
 
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['UPLOAD_FOLDER'] = '/tmp/uploads'
-ALLOWED_EXTENSIONS = {'pdf', 'txt', 'docx'}
-
-# Ensure upload folder exists
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+ALLOWED_EXTENSIONS = frozenset({'pdf', 'txt', 'docx'})
+MIN_CONTRACT_LENGTH = 100  # characters
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 3600  # 1 hour
+COMPRESS_MIN_SIZE = 1024  # bytes; smaller bodies aren't worth compressing
+COMPRESS_LEVEL = 4
+STATIC_MAX_AGE = 3600  # 1 hour for assets whose names don't change with content
+HASHED_ASSET_MAX_AGE = 31536000  # 1 year for content-hashed assets (app.1a2b3c4d.js)
+HASHED_ASSET_RE = re.compile(r'\.[0-9a-f]{8,}\.\w+$')
+PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -26,82 +53,248 @@ logger = logging.getLogger(__name__)
 analyzer = ContractAnalyzer()
 pdf_processor = PDFProcessor()
 
+# Finished results keyed on content hash, so re-submitted contracts skip Gemini.
+# Only touched from the event loop, so no locking is needed.
+analysis_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+comparison_cache = TTLCache(maxsize=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL)
+
+# Gemini calls currently running, keyed like the caches above
+inflight_requests = {}
+
 def allowed_file(filename):
-    """Check if file extension is allowed"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    """Return the file's lowercased extension if it is allowed, else None"""
+    if '.' not in filename:
+        return None
+    file_ext = filename.rsplit('.', 1)[1].lower()
+    return file_ext if file_ext in ALLOWED_EXTENSIONS else None
+
+def text_hash(text):
+    """Short, stable digest of contract text for use as a cache key"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+def apply_user_info_defaults(user_info):
+    """Fill in placeholder names and role for counter-proposals"""
+    user_info.setdefault('user_name', 'Your Name')
+    user_info.setdefault('other_party_name', 'Other Party')
+    user_info.setdefault('user_role', 'tenant')
+    return user_info
+
+def check_content_length(min_bytes):
+    """
+    Reject bodies from their Content-Length header before reading them
+    Too small to hold a contract -> True (caller returns 400); too large -> 413
+    """
+    content_length = request.content_length
+    if content_length is None:
+        return False
+    if content_length > app.config['MAX_CONTENT_LENGTH']:
+        abort(413)
+    return content_length < min_bytes
+
+def wants_stream():
+    """Clients opt in to NDJSON streaming with ?stream=1 or an Accept header"""
+    if request.args.get('stream') == '1':
+        return True
+    return 'application/x-ndjson' in request.headers.get('Accept', '')
+
+def to_ndjson(event):
+    """Encode one stream event as a newline-terminated JSON line"""
+    return orjson.dumps(event, option=orjson.OPT_NON_STR_KEYS) + b'\n'
+
+async def stream_analysis(contract_text, contract_type, cache_key):
+    """Yield NDJSON lines for an analysis, replaying the cached result when there is one"""
+    yield to_ndjson({'type': 'status', 'stage': 'analyzing', 'characters': len(contract_text)})
+    
+    try:
+        cached = analysis_cache.get(cache_key)
+        if cached is not None:
+            for event in analyzer.analysis_events(cached):
+                yield to_ndjson(event)
+            return
+        
+        async for event in analyzer.analyze_stream(contract_text, contract_type):
+            if event['type'] == 'complete' and 'error' not in event['analysis']:
+                analysis_cache[cache_key] = event['analysis']
+            yield to_ndjson(event)
+    
+    except Exception as e:
+        logger.error(f"Error streaming contract analysis: {str(e)}")
+        yield to_ndjson({'type': 'error', 'error': 'Failed to analyze contract', 'message': str(e)})
+
+def _finish_inflight(cache, key, task):
+    """Drop a finished call from the in-flight table and cache a good result"""
+    inflight_requests.pop(key, None)
+    if task.cancelled() or task.exception() is not None:
+        return
+    result = task.result()
+    if 'error' not in result:
+        cache[key] = result
+
+async def run_coalesced(cache, key, make_call):
+    """
+    Return a cached result, join an identical in-flight call, or start a new one
+    Concurrent identical submissions share a single Gemini request
+    """
+    result = cache.get(key)
+    if result is not None:
+        logger.info("Serving cached result")
+        return result
+    
+    task = inflight_requests.get(key)
+    if task is None:
+        task = asyncio.create_task(make_call())
+        inflight_requests[key] = task
+        task.add_done_callback(functools.partial(_finish_inflight, cache, key))
+    else:
+        logger.info("Joining in-flight request for identical contract")
+    
+    # Shield so one client disconnecting doesn't cancel the call for the others
+    return await asyncio.shield(task)
+
+@app.after_request
+async def compress_response(response):
+    """Brotli/gzip-compress JSON responses for clients that accept it"""
+    if response.mimetype != 'application/json' or 'Content-Encoding' in response.headers:
+        return response
+    
+    encoding = request.accept_encodings.best_match(('br', 'gzip'))
+    if encoding is None:
+        return response
+    
+    data = await response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=COMPRESS_LEVEL))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+async def send_static(path, cache_control):
+    """Serve a frontend file, preferring a precompressed .br/.gz sibling the client accepts"""
+    response = None
+    
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        # Indexing gives the quality, so "gzip;q=0" counts as a refusal
+        if request.accept_encodings[encoding] <= 0:
+            continue
+        compressed_path = safe_join(app.static_folder, path + suffix)
+        if compressed_path and os.path.isfile(compressed_path):
+            response = await send_from_directory(
+                app.static_folder, path + suffix,
+                mimetype=mimetypes.guess_type(path)[0]
+            )
+            response.headers['Content-Encoding'] = encoding
+            break
+    
+    if response is None:
+        response = await send_from_directory(app.static_folder, path)
+    
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/')
-def index():
-    """Serve the frontend"""
-    return send_from_directory(app.static_folder, 'index.html')
+async def index():
+    """Serve the frontend (always revalidated so new deploys show up immediately)"""
+    return await send_static('index.html', 'no-cache')
 
 @app.route('/<path:path>')
-def static_files(path):
-    """Serve static files"""
-    return send_from_directory(app.static_folder, path)
+async def static_files(path):
+    """Serve static files; content-hashed names are cached as immutable"""
+    # The .br/.gz siblings are only served through content negotiation; fetched
+    # directly they would go out with the wrong type and no Content-Encoding
+    if path.endswith(tuple(suffix for _, suffix in PRECOMPRESSED_SUFFIXES)):
+        abort(404)
+    
+    if HASHED_ASSET_RE.search(path):
+        cache_control = f'public, max-age={HASHED_ASSET_MAX_AGE}, immutable'
+    elif path.endswith('.html'):
+        cache_control = 'no-cache'
+    else:
+        cache_control = f'public, max-age={STATIC_MAX_AGE}'
+    return await send_static(path, cache_control)
 
 @app.route('/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Health check endpoint for Cloud Run"""
     return jsonify({'status': 'healthy', 'service': 'ContractGuard AI'}), 200
 
 @app.route('/api/analyze', methods=['POST'])
-def analyze_contract():
+async def analyze_contract():
     """
     Analyze a contract document
     Accepts: PDF, DOCX, or plain text
-    Returns: JSON with analysis results
+    Returns: JSON with analysis results, or NDJSON events with ?stream=1
     """
+    # Any body shorter than the minimum contract can't be valid; skip parsing it
+    if check_content_length(MIN_CONTRACT_LENGTH):
+        return jsonify({'error': 'Contract text is too short. Please provide a complete contract.'}), 400
+    
     try:
         contract_text = None
         contract_type = None
+        text_is_clean = False
+        
+        files = await request.files
         
         # Check if file was uploaded
-        if 'file' in request.files:
-            file = request.files['file']
+        if 'file' in files:
+            file = files['file']
             
             if file.filename == '':
                 return jsonify({'error': 'No file selected'}), 400
             
-            if not allowed_file(file.filename):
+            file_ext = allowed_file(file.filename)
+            if file_ext is None:
                 return jsonify({'error': 'File type not allowed. Please upload PDF, DOCX, or TXT'}), 400
             
-            # Save file temporarily
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            
-            # Extract text based on file type
-            file_ext = filename.rsplit('.', 1)[1].lower()
+            # Read the upload into memory (size is capped by MAX_CONTENT_LENGTH);
+            # the filename is only used for its extension and never touches disk
+            file_bytes = file.stream.read()
             
-            if file_ext == 'pdf':
-                contract_text = pdf_processor.extract_text_from_pdf(filepath)
-            elif file_ext == 'docx':
-                contract_text = pdf_processor.extract_text_from_docx(filepath)
+            # Extract text based on file type (parsing is CPU-bound, keep it off the event loop);
+            # a file seen recently is answered from the processor's text cache
+            if file_ext in ('pdf', 'docx'):
+                contract_text = await asyncio.to_thread(pdf_processor.extract_text_cached, file_bytes, file_ext)
+                text_is_clean = True
             elif file_ext == 'txt':
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    contract_text = f.read()
-            
-            # Clean up temporary file
-            os.remove(filepath)
+                contract_text = file_bytes.decode('utf-8')
             
         # Check if text was provided directly
         elif request.is_json:
-            data = request.get_json()
+            data = await request.get_json()
             contract_text = data.get('text')
             contract_type = data.get('type')  # Optional: rental, employment, etc.
         
         else:
             return jsonify({'error': 'No contract provided. Please upload a file or provide text.'}), 400
         
-        # Validate contract text
-        if not contract_text or len(contract_text.strip()) < 100:
+        # Validate contract text (extracted PDF/DOCX text is already stripped)
+        too_short = not contract_text or len(contract_text) < MIN_CONTRACT_LENGTH
+        if not too_short and not text_is_clean:
+            too_short = len(contract_text.strip()) < MIN_CONTRACT_LENGTH
+        if too_short:
             return jsonify({'error': 'Contract text is too short. Please provide a complete contract.'}), 400
         
         logger.info(f"Analyzing contract of length: {len(contract_text)} characters")
         
-        # Analyze the contract
-        analysis = analyzer.analyze(contract_text, contract_type)
+        # Analyze the contract (or reuse the result for an identical submission)
+        cache_key = ('analyze', text_hash(contract_text), contract_type)
+        
+        if wants_stream():
+            return Response(
+                stream_analysis(contract_text, contract_type, cache_key),
+                mimetype='application/x-ndjson'
+            )
+        
+        analysis = await run_coalesced(
+            analysis_cache, cache_key,
+            lambda: analyzer.analyze_async(contract_text, contract_type)
+        )
         
         logger.info(f"Analysis complete. Risk score: {analysis.get('risk_score', 'N/A')}")
         
@@ -115,7 +308,7 @@ def analyze_contract():
         }), 500
 
 @app.route('/api/sample-contracts', methods=['GET'])
-def get_sample_contracts():
+async def get_sample_contracts():
     """Return list of sample contracts for demo"""
     samples = [
         {
@@ -140,13 +333,16 @@ def get_sample_contracts():
     return jsonify(samples), 200
 
 @app.route('/api/compare', methods=['POST'])
-def compare_contracts():
+async def compare_contracts():
     """
     Compare two versions of a contract
     Accepts: original and revised contract text
     """
+    if check_content_length(2 * MIN_CONTRACT_LENGTH):
+        return jsonify({'error': 'Contracts too short. Please provide complete contract text.'}), 400
+    
     try:
-        data = request.get_json()
+        data = await request.get_json()
         original = data.get('original')
         revised = data.get('revised')
         user_side = data.get('user_side', 'tenant')
@@ -154,12 +350,16 @@ def compare_contracts():
         if not original or not revised:
             return jsonify({'error': 'Both original and revised contracts required'}), 400
         
-        if len(original) < 100 or len(revised) < 100:
+        if len(original) < MIN_CONTRACT_LENGTH or len(revised) < MIN_CONTRACT_LENGTH:
             return jsonify({'error': 'Contracts too short. Please provide complete contract text.'}), 400
         
         logger.info(f"Comparing contracts for {user_side}")
         
-        comparison = analyzer.compare_contracts(original, revised, user_side)
+        cache_key = ('compare', text_hash(original), text_hash(revised), user_side)
+        comparison = await run_coalesced(
+            comparison_cache, cache_key,
+            lambda: analyzer.compare_contracts_async(original, revised, user_side)
+        )
         
         logger.info(f"Comparison complete. Verdict: {comparison.get('overall_verdict')}")
         
@@ -173,12 +373,12 @@ def compare_contracts():
         }), 500
 
 @app.route('/api/counter-proposal', methods=['POST'])
-def create_counter_proposal():
+async def create_counter_proposal():
     """
     Generate counter-proposal based on analysis
     """
     try:
-        data = request.get_json()
+        data = await request.get_json()
         analysis = data.get('analysis')
         user_info = data.get('user_info', {})
         
@@ -186,16 +386,11 @@ def create_counter_proposal():
             return jsonify({'error': 'Analysis results required'}), 400
         
         # Set defaults for user_info
-        if 'user_name' not in user_info:
-            user_info['user_name'] = 'Your Name'
-        if 'other_party_name' not in user_info:
-            user_info['other_party_name'] = 'Other Party'
-        if 'user_role' not in user_info:
-            user_info['user_role'] = 'tenant'
+        apply_user_info_defaults(user_info)
         
         logger.info(f"Generating counter-proposal for {user_info.get('user_role')}")
         
-        counter_proposal = analyzer.generate_counter_proposal(analysis, user_info)
+        counter_proposal = await analyzer.generate_counter_proposal_async(analysis, user_info)
         
         logger.info("Counter-proposal generated successfully")
         
@@ -208,11 +403,56 @@ def create_counter_proposal():
             'message': str(e)
         }), 500
 
+@app.route('/api/full-analysis', methods=['POST'])
+async def full_analysis():
+    """
+    Analyze a contract, compare it with a revision and draft a counter-proposal in one call
+    Accepts: text, optional type, revised, user_side and user_info
+    The independent Gemini calls run concurrently
+    """
+    if check_content_length(MIN_CONTRACT_LENGTH):
+        return jsonify({'error': 'Contract text is too short. Please provide a complete contract.'}), 400
+    
+    try:
+        data = await request.get_json()
+        contract_text = data.get('text')
+        revised = data.get('revised')
+        user_info = data.get('user_info')
+        
+        if not contract_text or len(contract_text.strip()) < MIN_CONTRACT_LENGTH:
+            return jsonify({'error': 'Contract text is too short. Please provide a complete contract.'}), 400
+        
+        if revised is not None and len(revised) < MIN_CONTRACT_LENGTH:
+            return jsonify({'error': 'Revised contract too short. Please provide complete contract text.'}), 400
+        
+        if user_info is not None:
+            apply_user_info_defaults(user_info)
+        
+        logger.info(f"Running full workflow for contract of length: {len(contract_text)} characters")
+        
+        result = await analyzer.run_full_workflow(
+            contract_text,
+            revised_text=revised,
+            user_info=user_info,
+            contract_type=data.get('type'),
+            user_side=data.get('user_side', 'tenant')
+        )
+        
+        logger.info("Full workflow complete")
+        
+        return jsonify(result), 200
+    
+    except Exception as e:
+        logger.error(f"Error running full workflow: {str(e)}")
+        return jsonify({
+            'error': 'Failed to analyze contract',
+            'message': str(e)
+        }), 500
+
 @app.route('/api/community-stats', methods=['GET'])
-def get_community_stats():
+async def get_community_stats():
     """Get aggregated community statistics"""
     try:
-        from community_data import get_aggregated_stats
         stats = get_aggregated_stats()
         return jsonify(stats), 200
     except Exception as e:
@@ -220,7 +460,7 @@ def get_community_stats():
         return jsonify({'error': 'Failed to get community statistics'}), 500
 
 @app.errorhandler(413)
-def file_too_large(e):
+async def file_too_large(e):
     """Handle file size exceeded error"""
     return jsonify({
         'error': 'File too large',
@@ -229,12 +469,12 @@ def file_too_large(e):
     }), 413
 
 @app.errorhandler(404)
-def not_found(e):
+async def not_found(e):
     """Handle 404 errors"""
     return jsonify({'error': 'Endpoint not found'}), 404
 
 @app.errorhandler(500)
-def internal_error(e):
+async def internal_error(e):
     """Handle internal server errors"""
     logger.error(f"Internal server error: {str(e)}")
     return jsonify({
@@ -246,9 +486,9 @@ if __name__ == '__main__':
     # Get port from environment variable (Cloud Run provides this)
     port = int(os.environ.get('PORT', 8080))
     
-    # Run the app
-    app.run(
-        host='0.0.0.0',
-        port=port,
-        debug=os.environ.get('FLASK_ENV') == 'development'
-    )
\ No newline at end of file
+    if os.environ.get('FLASK_ENV') == 'development':
+        # Quart's reloading debug server for local development
+        app.run(host='0.0.0.0', port=port, debug=True)
+    else:
+        # Single Uvicorn process; production uses the multi-worker uvicorn CLI (see Dockerfile)
+        uvicorn.run(app, host='0.0.0.0', port=port, log_level='info')
\ No newline at end of file
@@ -4,6 +4,11 @@ Simulates crowdsourced data from real users
 In production, this would be a real database (Firestore, PostgreSQL)
 """
 
+import functools
+import re
+import sys
+from types import MappingProxyType
+
 # Community-reported red flags with real outcomes
 COMMUNITY_DATABASE = {
     "non-refundable security deposit": {
@@ -208,15 +213,37 @@ COMMUNITY_DATABASE = {
 }
 
 
+def _build_keyword_index() -> dict:
+    """Map every database key and each of its words to the key (first key wins)"""
+    index = {}
+    for key in COMMUNITY_DATABASE:
+        index.setdefault(key, key)
+        for keyword in key.split():
+            index.setdefault(keyword, key)
+    return index
+
+
+# Keyword -> database key, built once so lookups don't rescan every entry
+_KEYWORD_INDEX = _build_keyword_index()
+
+# All keys and keywords as one alternation (longest first, so full keys win),
+# letting a single scan of the category find the first known term
+_KEYWORD_PATTERN = re.compile(
+    r'\b(?:' + '|'.join(re.escape(k) for k in sorted(_KEYWORD_INDEX, key=len, reverse=True)) + r')\b'
+)
+
+
+@functools.lru_cache(maxsize=256)
 def get_community_insights(red_flag_category: str) -> dict:
     """
     Get community insights for a specific red flag
+    Memoized per category: the model reuses the same category names across analyses
     
     Args:
         red_flag_category: The category of red flag
     
     Returns:
-        Dictionary with community data or None
+        Read-only mapping with community data or None
     """
     category_lower = red_flag_category.lower()
     
@@ -224,12 +251,15 @@ def get_community_insights(red_flag_category: str) -> dict:
     if category_lower in COMMUNITY_DATABASE:
         return COMMUNITY_DATABASE[category_lower]
     
-    # Try fuzzy matching
+    # Fall back to the first known keyword appearing in the category
+    match = _KEYWORD_PATTERN.search(category_lower)
+    if match:
+        return COMMUNITY_DATABASE[_KEYWORD_INDEX[match.group(0)]]
+    
+    # Then to substring matching, for partial words such as 'refund'
     for key, data in COMMUNITY_DATABASE.items():
         if key in category_lower or category_lower in key:
             return data
-        
-        # Check if any keywords match
         keywords = key.split()
         if any(keyword in category_lower for keyword in keywords):
             return data
@@ -237,8 +267,8 @@ def get_community_insights(red_flag_category: str) -> dict:
     return None
 
 
-def get_aggregated_stats() -> dict:
-    """Get overall community statistics"""
+def _compute_aggregated_stats() -> dict:
+    """Compute overall community statistics from COMMUNITY_DATABASE"""
     total_reports = sum(data['reports'] for data in COMMUNITY_DATABASE.values())
     total_successful = sum(
         data['user_outcomes']['negotiated_successfully'] 
@@ -275,25 +305,59 @@ def get_aggregated_stats() -> dict:
     }
 
 
+# The database is static, so the aggregate only needs computing once per process
+_AGGREGATED_STATS = _compute_aggregated_stats()
+
+
+def get_aggregated_stats() -> dict:
+    """Get overall community statistics (precomputed at import)"""
+    return _AGGREGATED_STATS
+
+
+# Severity -> (emoji, label); keys are interned like the database severities,
+# so lookups for database entries resolve on identity
+_SEVERITY_LABELS = {
+    sys.intern('CRITICAL'): ('🚨', 'CRITICAL ALERT'),
+    sys.intern('HIGH'): ('⚠️', 'HIGH RISK'),
+}
+_DEFAULT_SEVERITY_LABEL = ('⚡', 'CAUTION')
+
+
 def format_community_warning(data: dict) -> str:
     """Format a warning message based on community data"""
-    reports = data['reports']
-    success_rate = int(data['success_rate_negotiating'] * 100)
+    return _format_warning(
+        data['reports'], data['severity'], data['avg_financial_impact'], data['success_rate_negotiating']
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _format_warning(reports: int, severity: str, avg_financial_impact: int, success_rate_negotiating: float) -> str:
+    """Build the warning text; memoized on the fields it depends on"""
+    success_rate = int(success_rate_negotiating * 100)
     
-    if data['severity'] == 'CRITICAL':
-        emoji = '🚨'
-        level = 'CRITICAL ALERT'
-    elif data['severity'] == 'HIGH':
-        emoji = '⚠️'
-        level = 'HIGH RISK'
-    else:
-        emoji = '⚡'
-        level = 'CAUTION'
+    emoji, level = _SEVERITY_LABELS.get(severity, _DEFAULT_SEVERITY_LABEL)
     
     warning = f"{emoji} {level}: {reports:,} users reported similar issues. "
     warning += f"{success_rate}% successfully negotiated this clause."
     
-    if data['avg_financial_impact'] > 0:
-        warning += f" Average impact: ${data['avg_financial_impact']:,}."
+    if avg_financial_impact > 0:
+        warning += f" Average impact: ${avg_financial_impact:,}."
     
-    return warning
\ No newline at end of file
+    return warning
+
+def _attach_warnings() -> None:
+    """Store the formatted warning on each static entry so it is built only once"""
+    for data in COMMUNITY_DATABASE.values():
+        data['warning_message'] = format_community_warning(data)
+
+
+def _freeze_database() -> None:
+    """Intern repeated labels and make each entry read-only"""
+    for key, data in list(COMMUNITY_DATABASE.items()):
+        data['severity'] = sys.intern(data['severity'])
+        data['common_in'] = tuple(sys.intern(c) for c in data['common_in'])
+        COMMUNITY_DATABASE[key] = MappingProxyType(data)
+
+
+_attach_warnings()
+_freeze_database()
@@ -1,12 +1,103 @@
 import google.generativeai as genai
+import asyncio
+import ijson
 import os
-import json
+import hashlib
 import logging
-from typing import Dict, Optional
+import orjson
+import re
+import threading
+import tiktoken
+import time
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional
 from community_data import get_community_insights, format_community_warning
+from prompts import (
+    ANALYZE_TEMPLATE, COMPARE_TEMPLATE, COUNTER_TEMPLATE, FLAG_CRITERIA, MAP_TEMPLATE, PROMPT_VERSION,
+    REDUCE_TEMPLATE
+)
+from rate_limiter import (
+    MAX_ATTEMPTS, backoff_delay, estimate_tokens, gemini_limiter, is_rate_limit_error, log_retry
+)
 
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = 'gemini-2.0-flash-exp'
+
+# Cap on Gemini calls in flight at once from one process (per-model RPM limits)
+GEMINI_MAX_CONCURRENCY = 8
+
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 7 * 24 * 3600  # 7 days
+
+# Reuse analyses of near-identical contracts (needs sentence-transformers)
+SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE') == '1'
+
+# A response wrapped in a markdown code fence, and the outermost {...} in chattier replies
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+_JSON_OBJ_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Contracts longer than this (~20 pages) are analyzed chunk by chunk and merged
+MAP_REDUCE_MIN_CHARS = 48000
+MAP_CHUNK_CHARS = 12000  # ~3k tokens per chunk
+
+# Token budget for each contract version in the comparison prompt. Gemini's
+# tokenizer isn't published; cl100k_base counts slightly high, so it is a safe bound
+COMPARE_MAX_TOKENS = 2000
+TOKENIZER_ENCODING = 'cl100k_base'
+# After a failed load (usually the download), wait this long before trying again
+ENCODING_RETRY_SECONDS = 300
+
+_encoding = None
+_encoding_failed_at = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding() -> Optional[tiktoken.Encoding]:
+    """
+    Load the tokenizer once per process
+    tiktoken downloads the encoding on first use (unless it is in TIKTOKEN_CACHE_DIR),
+    so call this off the event loop. If loading fails, None tells callers to fall
+    back to a character estimate until the next retry is due
+    """
+    global _encoding, _encoding_failed_at
+    with _encoding_lock:
+        if _encoding is None and (
+            _encoding_failed_at is None or time.monotonic() - _encoding_failed_at >= ENCODING_RETRY_SECONDS
+        ):
+            try:
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                logger.warning(f"Tokenizer unavailable, truncating by characters: {str(e)}")
+                _encoding_failed_at = time.monotonic()
+        return _encoding
+
+# Model handles shared by every ContractAnalyzer in the process, keyed on model name.
+# genai.configure sets the SDK's global client, so one API key serves the whole process
+_MODELS: Dict[str, genai.GenerativeModel] = {}
+_MODELS_LOCK = threading.Lock()
+_configured_api_key = None
+
+
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """Configure Gemini on first use and build the model once; later calls reuse it"""
+    global _configured_api_key
+    with _MODELS_LOCK:
+        if _configured_api_key is None:
+            genai.configure(api_key=api_key)
+            _configured_api_key = api_key
+        elif api_key != _configured_api_key:
+            # Reconfiguring would silently switch the key of every model already built
+            raise ValueError("Gemini is already configured with a different API key; use one key per process")
+        
+        model = _MODELS.get(model_name)
+        if model is None:
+            model = _MODELS[model_name] = genai.GenerativeModel(model_name)
+        return model
+
+
 class ContractAnalyzer:
     """
     Analyzes contracts using Google's Gemini AI
@@ -20,8 +111,19 @@ class ContractAnalyzer:
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set")
         
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
+        self.model = _get_model(api_key, MODEL_NAME)
+        
+        # Raw Gemini responses keyed on a hash of the exact prompt; shared by the
+        # sync methods (run from worker threads) and the async ones, hence the lock
+        self._response_cache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+        self._response_cache_lock = threading.Lock()
+        self._gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        
+        self._semantic_cache = None
+        if SEMANTIC_CACHE_ENABLED:
+            from semantic_cache import SemanticCache
+            self._semantic_cache = SemanticCache()
+            logger.info("Semantic analysis cache enabled")
         logger.info("ContractAnalyzer initialized with Gemini 2.0 Flash")
     
     def analyze(self, contract_text: str, contract_type: Optional[str] = None) -> Dict:
@@ -37,24 +139,313 @@ class ContractAnalyzer:
             Dictionary containing analysis results with community data
         """
         try:
-            # Generate the analysis prompt
-            prompt = self._build_prompt(contract_text, contract_type)
+            # Reuse the analysis of a near-identical contract if there is one
+            vector = None
+            if self._semantic_cache is not None:
+                vector = self._semantic_cache.embed(contract_text)
+                cached = self._semantic_cache.lookup(vector, contract_type)
+                if cached is not None:
+                    return self._finish_analysis(cached)
             
-            # Get response from Gemini
-            response = self.model.generate_content(prompt)
+            analysis = self._analyze_fresh(contract_text, contract_type)
             
-            # Parse the response
-            analysis = self._parse_response(response.text)
+            if vector is not None and 'error' not in analysis:
+                self._semantic_cache.add(vector, contract_type, analysis)
             
-            # Enhance with community data
-            analysis = self._enrich_with_community_data(analysis)
+            return self._finish_analysis(analysis)
+        
+        except Exception as e:
+            logger.error(f"Error during contract analysis: {str(e)}")
+            raise
+    
+    async def analyze_async(self, contract_text: str, contract_type: Optional[str] = None) -> Dict:
+        """
+        Async variant of analyze
+        Awaits Gemini on the event loop instead of blocking a worker thread
+        """
+        try:
+            vector = None
+            if self._semantic_cache is not None:
+                # Embedding is CPU-bound; keep it off the event loop
+                vector = await asyncio.to_thread(self._semantic_cache.embed, contract_text)
+                cached = self._semantic_cache.lookup(vector, contract_type)
+                if cached is not None:
+                    return self._finish_analysis(cached)
             
-            return analysis
+            analysis = await self._analyze_fresh_async(contract_text, contract_type)
+            
+            if vector is not None and 'error' not in analysis:
+                self._semantic_cache.add(vector, contract_type, analysis)
+            
+            return self._finish_analysis(analysis)
         
         except Exception as e:
             logger.error(f"Error during contract analysis: {str(e)}")
             raise
     
+    def analyze_batch(self, contract_texts: List[str], contract_type: Optional[str] = None) -> List[Dict]:
+        """
+        Analyze several contracts of the same type
+        With the semantic cache enabled, all contracts are embedded in one batch
+        and matched together; only the misses go to Gemini, concurrently
+        
+        Args:
+            contract_texts: The full text of each contract
+            contract_type: Optional contract type shared by the batch
+        
+        Returns:
+            One analysis per contract, in order
+        """
+        try:
+            vectors = None
+            if self._semantic_cache is not None and contract_texts:
+                vectors = self._semantic_cache.embed_many(contract_texts)
+            analyses = self._batch_lookup(len(contract_texts), contract_type, vectors)
+            misses = [i for i, analysis in enumerate(analyses) if analysis is None]
+            
+            fresh = []
+            if misses:
+                with ThreadPoolExecutor(max_workers=min(GEMINI_MAX_CONCURRENCY, len(misses))) as pool:
+                    fresh = list(pool.map(lambda i: self._analyze_fresh(contract_texts[i], contract_type), misses))
+            
+            return self._finish_batch(analyses, vectors, contract_type, misses, fresh)
+        
+        except Exception as e:
+            logger.error(f"Error during batch contract analysis: {str(e)}")
+            raise
+    
+    async def analyze_batch_async(self, contract_texts: List[str], contract_type: Optional[str] = None) -> List[Dict]:
+        """Async variant of analyze_batch"""
+        try:
+            vectors = None
+            if self._semantic_cache is not None and contract_texts:
+                vectors = await asyncio.to_thread(self._semantic_cache.embed_many, contract_texts)
+            analyses = self._batch_lookup(len(contract_texts), contract_type, vectors)
+            misses = [i for i, analysis in enumerate(analyses) if analysis is None]
+            
+            fresh = await asyncio.gather(*[
+                self._analyze_fresh_async(contract_texts[i], contract_type) for i in misses
+            ])
+            
+            return self._finish_batch(analyses, vectors, contract_type, misses, fresh)
+        
+        except Exception as e:
+            logger.error(f"Error during batch contract analysis: {str(e)}")
+            raise
+    
+    async def analyze_stream(self, contract_text: str, contract_type: Optional[str] = None) -> AsyncIterator[Dict]:
+        """
+        Analyze a contract, yielding events as results become available
+        
+        Yields 'red_flag' and 'yellow_flag' events, then a final 'complete'
+        event carrying the full analysis. Gemini's output is parsed as it
+        arrives, so each flag is sent as soon as the model has written it
+        """
+        if self._semantic_cache is not None or len(contract_text) > MAP_REDUCE_MIN_CHARS:
+            # Neither path has a single response to stream
+            analysis = await self.analyze_async(contract_text, contract_type)
+            for event in self.analysis_events(analysis):
+                yield event
+            return
+        
+        try:
+            prompt = self._build_prompt(contract_text, contract_type)
+            key = self._response_cache_key(prompt, 'analyze')
+            response_text = self._cached_response(key)
+            if response_text is not None:
+                logger.info("Response cache hit for analyze")
+                for event in self.analysis_events(self._finish_analysis(self._parse_response(response_text))):
+                    yield event
+                return
+            
+            parser = FlagStreamParser()
+            parts = []
+            async for text in self._agenerate_stream(prompt):
+                parts.append(text)
+                for flag_type, flag in parser.feed(text):
+                    if flag_type == 'red_flag':
+                        flag = self._enrich_flag(flag)
+                    yield {'type': flag_type, 'flag': flag}
+            
+            # The full response is still validated and cached as usual
+            analysis = self._parse_and_store(key, ''.join(parts), self._parse_response)
+            yield {'type': 'complete', 'analysis': self._finish_analysis(analysis)}
+        
+        except Exception as e:
+            logger.error(f"Error during contract analysis: {str(e)}")
+            raise
+    
+    def analysis_events(self, analysis: Dict) -> Iterator[Dict]:
+        """Break a finished analysis into the events emitted by analyze_stream"""
+        for flag in analysis.get('red_flags', []):
+            yield {'type': 'red_flag', 'flag': flag}
+        for flag in analysis.get('yellow_flags', []):
+            yield {'type': 'yellow_flag', 'flag': flag}
+        yield {'type': 'complete', 'analysis': analysis}
+    
+    def _finish_analysis(self, analysis: Dict) -> Dict:
+        """Enrich a parsed analysis with community data"""
+        return self._enrich_with_community_data(analysis)
+    
+    def _analyze_fresh(self, contract_text: str, contract_type: Optional[str]) -> Dict:
+        """Ask Gemini for an analysis, chunking long contracts"""
+        if len(contract_text) > MAP_REDUCE_MIN_CHARS:
+            return self._map_reduce(contract_text, contract_type)
+        
+        # Generate the analysis prompt
+        prompt = self._build_prompt(contract_text, contract_type)
+        
+        # Get response from Gemini
+        return self._generate_parsed(prompt, 'analyze')
+    
+    async def _analyze_fresh_async(self, contract_text: str, contract_type: Optional[str]) -> Dict:
+        """Async variant of _analyze_fresh"""
+        if len(contract_text) > MAP_REDUCE_MIN_CHARS:
+            return await self._map_reduce_async(contract_text, contract_type)
+        
+        prompt = self._build_prompt(contract_text, contract_type)
+        return await self._agenerate_parsed(prompt, 'analyze')
+    
+    def _batch_lookup(self, count: int, contract_type: Optional[str], vectors) -> List[Optional[Dict]]:
+        """Match a batch's embeddings against the semantic cache; None marks a miss"""
+        if vectors is None:
+            return [None] * count
+        return self._semantic_cache.lookup_many(vectors, contract_type)
+    
+    def _finish_batch(self, analyses: List[Optional[Dict]], vectors, contract_type: Optional[str],
+                      misses: List[int], fresh: List[Dict]) -> List[Dict]:
+        """Slot fresh analyses into the batch, cache the good ones together and enrich all"""
+        stored = []
+        for i, analysis in zip(misses, fresh):
+            analyses[i] = analysis
+            if 'error' not in analysis:
+                stored.append(i)
+        
+        if vectors is not None and stored:
+            self._semantic_cache.add_many(vectors[stored], contract_type, [analyses[i] for i in stored])
+        
+        return [self._finish_analysis(analysis) for analysis in analyses]
+    
+    def _map_reduce(self, contract_text: str, contract_type: Optional[str]) -> Dict:
+        """
+        Analyze a long contract chunk by chunk
+        Each chunk gets a short flags-only prompt; a final prompt over the merged
+        flags produces the overall assessment
+        """
+        chunks = self._split_clauses(contract_text)
+        logger.info(f"Analyzing long contract in {len(chunks)} chunks")
+        
+        with ThreadPoolExecutor(max_workers=min(GEMINI_MAX_CONCURRENCY, len(chunks))) as pool:
+            partials = list(pool.map(
+                lambda args: self._generate_parsed(self._map_prompt(*args), 'map', self._parse_map_response),
+                [(chunk, contract_type, i + 1, len(chunks)) for i, chunk in enumerate(chunks)]
+            ))
+        
+        merged = self._merge_partials(partials)
+        summary = self._generate_parsed(self._reduce_prompt(merged, contract_type), 'reduce')
+        return self._finish_map_reduce(summary, merged, len(chunks))
+    
+    async def _map_reduce_async(self, contract_text: str, contract_type: Optional[str]) -> Dict:
+        """Async variant of _map_reduce; chunk prompts run concurrently"""
+        chunks = self._split_clauses(contract_text)
+        logger.info(f"Analyzing long contract in {len(chunks)} chunks")
+        
+        partials = await asyncio.gather(*[
+            self._agenerate_parsed(
+                self._map_prompt(chunk, contract_type, i + 1, len(chunks)), 'map', self._parse_map_response
+            )
+            for i, chunk in enumerate(chunks)
+        ])
+        
+        merged = self._merge_partials(partials)
+        summary = await self._agenerate_parsed(self._reduce_prompt(merged, contract_type), 'reduce')
+        return self._finish_map_reduce(summary, merged, len(chunks))
+    
+    def _split_clauses(self, text: str, max_chars: int = MAP_CHUNK_CHARS) -> List[str]:
+        """
+        Split a contract into chunks of at most max_chars
+        Paragraphs are packed greedily so clauses stay whole; a paragraph longer
+        than max_chars is cut at the last whitespace before the limit
+        """
+        chunks = []
+        current = []
+        current_len = 0
+        
+        for paragraph in text.split('\n\n'):
+            if current and current_len + len(paragraph) > max_chars:
+                chunks.append('\n\n'.join(current))
+                current = []
+                current_len = 0
+            
+            while len(paragraph) > max_chars:
+                cut = paragraph.rfind(' ', 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                chunks.append(paragraph[:cut])
+                paragraph = paragraph[cut:].lstrip()
+            
+            if paragraph:
+                current.append(paragraph)
+                current_len += len(paragraph) + 2
+        
+        if current:
+            chunks.append('\n\n'.join(current))
+        
+        return chunks
+    
+    def _merge_partials(self, partials: List[Dict]) -> Dict:
+        """
+        Concatenate the flags found in each chunk, dropping duplicates
+        Flags match on category plus the start of the quoted clause, so a clause
+        repeated across chunks (or restated in a schedule) is reported once;
+        chunks whose response could not be parsed are counted in failed_chunks
+        """
+        merged = {
+            'red_flags': [], 'yellow_flags': [], 'positive_aspects': [], 'section_summaries': [],
+            'failed_chunks': 0
+        }
+        seen = set()
+        
+        for partial in partials:
+            if 'error' in partial:
+                merged['failed_chunks'] += 1
+            for kind in ('red_flags', 'yellow_flags'):
+                for flag in partial.get(kind, []):
+                    key = (
+                        str(flag.get('category', '')).strip().lower(),
+                        ' '.join(str(flag.get('clause_text', '')).split())[:80].lower()
+                    )
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    merged[kind].append(flag)
+            
+            merged['positive_aspects'].extend(partial.get('positive_aspects', []))
+            if partial.get('section_summary'):
+                merged['section_summaries'].append(partial['section_summary'])
+        
+        return merged
+    
+    def _finish_map_reduce(self, summary: Dict, merged: Dict, chunk_count: int) -> Dict:
+        """
+        Attach the merged chunk flags to the overall assessment
+        If any chunk failed the result is marked with an error so it is not cached
+        """
+        summary['red_flags'] = merged['red_flags']
+        summary['yellow_flags'] = merged['yellow_flags']
+        summary.setdefault('positive_aspects', merged['positive_aspects'])
+        
+        metadata = summary.setdefault('analysis_metadata', {'model': MODEL_NAME, 'timestamp': self._get_timestamp()})
+        metadata['total_flags'] = len(merged['red_flags']) + len(merged['yellow_flags'])
+        metadata['chunks'] = chunk_count
+        
+        if merged['failed_chunks']:
+            metadata['failed_chunks'] = merged['failed_chunks']
+            summary['error'] = f"{merged['failed_chunks']} of {chunk_count} sections could not be analyzed"
+            logger.warning(f"Map-reduce analysis incomplete: {summary['error']}")
+        
+        return summary
+    
     def compare_contracts(self, original_text: str, revised_text: str, user_side: str = "tenant") -> Dict:
         """
         Compare two versions of a contract and identify changes
@@ -67,92 +458,78 @@ class ContractAnalyzer:
         Returns:
             Dictionary with comparison results
         """
-        prompt = f"""You are a contract comparison expert helping a {user_side}.
-
-Compare these two versions of a contract and provide detailed analysis:
-
-**ANALYSIS REQUIREMENTS:**
-
-1. **IDENTIFY ALL CHANGES**: Every clause that was added, removed, or modified
-2. **WINNER ANALYSIS**: For each change, determine who benefits:
-   - ✓ Benefits {user_side} 
-   - ✗ Benefits other party
-   - ~ Neutral or unclear
-3. **CONCERNS ADDRESSED**: What red flags from original were fixed
-4. **NEW PROBLEMS**: Any new concerning issues introduced
-5. **CONCERNS IGNORED**: What major problems remain unfixed
-6. **OVERALL VERDICT**: Should the {user_side} accept this revision?
-
-ORIGINAL CONTRACT:
-{original_text[:3000]}...
-
----
-
-REVISED CONTRACT:
-{revised_text[:3000]}...
-
-Return ONLY valid JSON with this structure:
-{{
-  "summary": "2-3 sentence overview of the revision",
-  "total_changes": 5,
-  "changes_favoring_user": 2,
-  "changes_favoring_other": 2,
-  "neutral_changes": 1,
-  "overall_verdict": "ACCEPT/NEGOTIATE_MORE/REJECT",
-  "verdict_explanation": "Why you should accept/negotiate/reject",
-  
-  "changes": [
-    {{
-      "section": "Section 3.2 - Security Deposit",
-      "change_type": "modified/added/removed",
-      "original_text": "Quote from original (if applicable)",
-      "revised_text": "Quote from revision (if applicable)",
-      "who_benefits": "{user_side}/other_party/neutral",
-      "benefit_level": "major/minor",
-      "explanation": "Clear explanation of what changed and why it matters",
-      "impact": "positive/negative/neutral"
-    }}
-  ],
-  
-  "addressed_concerns": [
-    "Security deposit is now refundable",
-    "Late fee reduced from $150 to $50"
-  ],
-  
-  "ignored_concerns": [
-    "Automatic renewal clause still present",
-    "One-sided termination rights unchanged"
-  ],
-  
-  "new_issues": [
-    "Added mandatory arbitration clause",
-    "Increased monthly maintenance fee"
-  ],
-  
-  "recommendation": "Detailed 2-3 sentence advice on what the {user_side} should do next",
-  
-  "next_steps": [
-    "Ask about the new arbitration clause",
-    "Request removal of automatic renewal",
-    "Confirm security deposit refund process in writing"
-  ]
-}}"""
-
+        prompt, truncated = self._build_compare_prompt(original_text, revised_text, user_side)
+        
         try:
-            response = self.model.generate_content(prompt)
-            comparison = self._parse_response(response.text)
-            
-            # Add metadata
-            comparison['comparison_metadata'] = {
-                'user_side': user_side,
-                'timestamp': self._get_timestamp()
-            }
-            
-            return comparison
+            comparison = self._generate_parsed(prompt, 'compare')
+            return self._finish_comparison(comparison, user_side, truncated)
+        
+        except Exception as e:
+            logger.error(f"Error comparing contracts: {str(e)}")
+            raise
+    
+    async def compare_contracts_async(self, original_text: str, revised_text: str, user_side: str = "tenant") -> Dict:
+        """
+        Async variant of compare_contracts
+        Awaits Gemini on the event loop instead of blocking a worker thread
+        """
+        # Tokenizing (and loading the tokenizer on first use) would block the loop
+        prompt, truncated = await asyncio.to_thread(self._build_compare_prompt, original_text, revised_text, user_side)
+        
+        try:
+            comparison = await self._agenerate_parsed(prompt, 'compare')
+            return self._finish_comparison(comparison, user_side, truncated)
         
         except Exception as e:
             logger.error(f"Error comparing contracts: {str(e)}")
             raise
+    
+    def _build_compare_prompt(self, original_text: str, revised_text: str, user_side: str) -> tuple:
+        """
+        Build the comparison prompt for Gemini
+        
+        Returns:
+            The prompt, and whether either contract had to be truncated to fit it
+        """
+        original = self._truncate_tokens(original_text, COMPARE_MAX_TOKENS)
+        revised = self._truncate_tokens(revised_text, COMPARE_MAX_TOKENS)
+        truncated = len(original) < len(original_text) or len(revised) < len(revised_text)
+        
+        prompt = COMPARE_TEMPLATE.substitute(
+            user_side=user_side,
+            original_text=original + ('...' if len(original) < len(original_text) else ''),
+            revised_text=revised + ('...' if len(revised) < len(revised_text) else '')
+        )
+        
+        return prompt, truncated
+    
+    def _truncate_tokens(self, text: str, max_tokens: int) -> str:
+        """Keep the leading max_tokens tokens of text, cutting on a token boundary"""
+        encoding = _get_encoding()
+        if encoding is None:
+            # Same ~4 characters per token estimate the rate limiter uses
+            kept = text[:max_tokens * 4]
+        else:
+            # Only a bounded prefix is encoded so huge uploads stay cheap; tokens average
+            # ~4 characters, and a prefix that comes in under budget still fits anyway
+            prefix = text[:max_tokens * 8]
+            tokens = encoding.encode(prefix, disallowed_special=())
+            kept = encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else prefix
+        
+        if len(kept) < len(text):
+            logger.info(f"Truncated contract from {len(text)} to {len(kept)} characters ({max_tokens} token budget)")
+        return kept
+    
+    def _finish_comparison(self, comparison: Dict, user_side: str, truncated: bool = False) -> Dict:
+        """Attach metadata to a parsed comparison"""
+        # Add metadata
+        comparison['comparison_metadata'] = {
+            'user_side': user_side,
+            'timestamp': self._get_timestamp(),
+            'input_truncated': truncated
+        }
+        
+        return comparison
 
     def generate_counter_proposal(self, analysis: Dict, user_info: Dict) -> Dict:
         """
@@ -165,117 +542,131 @@ Return ONLY valid JSON with this structure:
         Returns:
             Counter-proposal with revised clauses and email template
         """
+        red_flags = analysis.get('red_flags', [])[:5]  # Top 5 red flags
+        prompt = self._build_counter_prompt(analysis, user_info, red_flags)
         
+        try:
+            counter_proposal = self._generate_parsed(prompt, 'counter_proposal')
+            return self._finish_counter_proposal(counter_proposal, user_info, red_flags)
+        
+        except Exception as e:
+            logger.error(f"Error generating counter-proposal: {str(e)}")
+            raise
+    
+    async def generate_counter_proposal_async(self, analysis: Dict, user_info: Dict) -> Dict:
+        """
+        Async variant of generate_counter_proposal
+        Awaits Gemini on the event loop instead of blocking a worker thread
+        """
         red_flags = analysis.get('red_flags', [])[:5]  # Top 5 red flags
-        contract_type = user_info.get('contract_type', analysis.get('contract_type_detected', 'contract'))
-        user_role = user_info.get('user_role', 'party')
+        prompt = self._build_counter_prompt(analysis, user_info, red_flags)
         
-        prompt = f"""You are a professional contract negotiation consultant helping a {user_role}.
-
-Based on the red flags identified, create a comprehensive counter-proposal package.
-
-**RED FLAGS TO ADDRESS:**
-{json.dumps(red_flags, indent=2)}
-
-**CONTRACT TYPE:** {contract_type}
-**USER ROLE:** {user_role}
-
-Generate a complete negotiation package with:
-
-1. **REVISED CLAUSES**: Professional, fair replacements for each problematic clause
-2. **EMAIL TEMPLATE**: Ready-to-send professional email
-3. **TALKING POINTS**: Strong arguments with legal/practical backing
-4. **COMPROMISE OPTIONS**: Fallback positions if they resist
-
-Return ONLY valid JSON:
-{{
-  "revised_clauses": [
-    {{
-      "issue": "Security Deposit",
-      "original_clause": "The problematic clause text",
-      "revised_clause": "Professionally written fair replacement clause",
-      "justification": "Why this change is reasonable and fair",
-      "legal_basis": "Relevant laws, industry standards, or common practices",
-      "priority": "high/medium/low"
-    }}
-  ],
-  
-  "email_template": {{
-    "subject": "Contract Review - Proposed Amendments",
-    "greeting": "Dear [Other Party Name],",
-    "body": "Professional, friendly email body with:
-    - Appreciation for the opportunity
-    - Clear statement of concerns
-    - Specific proposed changes
-    - Explanation of fairness
-    - Open to discussion
-    - Professional close",
-    "tone": "professional_friendly",
-    "estimated_response_time": "2-5 business days"
-  }},
-  
-  "talking_points": [
-    {{
-      "issue": "Security Deposit Refundability",
-      "your_position": "Security deposit should be refundable",
-      "key_argument": "This is standard practice and legally required in [jurisdiction]",
-      "supporting_evidence": "State law citation, market standards, fairness principle",
-      "response_to_objections": "If they say it's their policy, respond with..."
-    }}
-  ],
-  
-  "compromise_options": [
-    {{
-      "if_they_say": "We can't change our standard contract",
-      "you_respond": "I understand. Would you consider...",
-      "middle_ground": "Specific compromise that's still acceptable",
-      "likelihood_of_success": "high/medium/low"
-    }}
-  ],
-  
-  "negotiation_strategy": {{
-    "approach": "collaborative/firm/flexible",
-    "key_principles": ["Principle 1", "Principle 2"],
-    "things_to_avoid": ["Don't be aggressive", "Don't accept first offer"],
-    "timeline": "Suggested negotiation timeline",
-    "when_to_walk_away": "Conditions under which to decline the contract"
-  }},
-  
-  "success_probability": {{
-    "overall_estimate": "high/medium/low",
-    "reasoning": "Why this negotiation is likely to succeed or fail",
-    "factors_in_your_favor": ["Factor 1", "Factor 2"],
-    "challenges": ["Challenge 1", "Challenge 2"]
-  }}
-}}"""
-
         try:
-            response = self.model.generate_content(prompt)
-            counter_proposal = self._parse_response(response.text)
-            
-            # Personalize email template
-            email = counter_proposal.get('email_template', {})
-            if email and 'body' in email:
-                body = email['body']
-                body = body.replace('[Your Name]', user_info.get('user_name', '[Your Name]'))
-                body = body.replace('[Other Party Name]', user_info.get('other_party_name', '[Other Party Name]'))
-                body = body.replace('[Other Party]', user_info.get('other_party_name', '[Other Party]'))
-                email['body'] = body
-                counter_proposal['email_template'] = email
-            
-            # Add metadata
-            counter_proposal['proposal_metadata'] = {
-                'generated_for': user_info.get('user_name'),
-                'timestamp': self._get_timestamp(),
-                'red_flags_addressed': len(red_flags)
-            }
-            
-            return counter_proposal
+            counter_proposal = await self._agenerate_parsed(prompt, 'counter_proposal')
+            return self._finish_counter_proposal(counter_proposal, user_info, red_flags)
         
         except Exception as e:
             logger.error(f"Error generating counter-proposal: {str(e)}")
             raise
     
+    async def run_full_workflow(self, contract_text: str, revised_text: Optional[str] = None,
+                                user_info: Optional[Dict] = None, contract_type: Optional[str] = None,
+                                user_side: str = "tenant") -> Dict:
+        """
+        Analyze a contract, compare it with a revision and draft a counter-proposal concurrently
+        
+        The comparison runs alongside the analysis; the counter-proposal needs the
+        analysis, so it starts as soon as that finishes
+        
+        Args:
+            contract_text: The full text of the contract
+            revised_text: Optional revised version to compare against
+            user_info: Optional user details; a counter-proposal is generated when given
+            contract_type: Optional contract type (rental, employment, nda, etc.)
+            user_side: Which side the user is on, for the comparison
+        
+        Returns:
+            Dictionary with 'analysis', 'comparison' and 'counter_proposal' (None when skipped)
+        """
+        async def analyze_then_counter():
+            analysis = await self.analyze_async(contract_text, contract_type)
+            if user_info is None:
+                return analysis, None
+            return analysis, await self.generate_counter_proposal_async(analysis, user_info)
+        
+        async def compare():
+            if revised_text is None:
+                return None
+            return await self.compare_contracts_async(contract_text, revised_text, user_side)
+        
+        (analysis, counter_proposal), comparison = await asyncio.gather(analyze_then_counter(), compare())
+        
+        return {
+            'analysis': analysis,
+            'comparison': comparison,
+            'counter_proposal': counter_proposal
+        }
+    
+    def run_full_workflow_sync(self, contract_text: str, revised_text: Optional[str] = None,
+                               user_info: Optional[Dict] = None, contract_type: Optional[str] = None,
+                               user_side: str = "tenant") -> Dict:
+        """
+        Blocking variant of run_full_workflow for callers without an event loop
+        
+        Uses threads rather than asyncio.run: Gemini's async client is tied to the
+        first event loop that uses it, so it can't be driven from a fresh loop per call
+        """
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            comparison_future = None
+            if revised_text is not None:
+                comparison_future = pool.submit(self.compare_contracts, contract_text, revised_text, user_side)
+            
+            analysis = self.analyze(contract_text, contract_type)
+            counter_proposal = None
+            if user_info is not None:
+                counter_proposal = self.generate_counter_proposal(analysis, user_info)
+            
+            return {
+                'analysis': analysis,
+                'comparison': comparison_future.result() if comparison_future else None,
+                'counter_proposal': counter_proposal
+            }
+    
+    def _build_counter_prompt(self, analysis: Dict, user_info: Dict, red_flags: list) -> str:
+        """Build the counter-proposal prompt for Gemini"""
+        
+        contract_type = user_info.get('contract_type', analysis.get('contract_type_detected', 'contract'))
+        user_role = user_info.get('user_role', 'party')
+        
+        prompt = COUNTER_TEMPLATE.substitute(
+            user_role=user_role,
+            contract_type=contract_type,
+            red_flags_json=orjson.dumps(red_flags, option=orjson.OPT_INDENT_2).decode()
+        )
+        
+        return prompt
+    
+    def _finish_counter_proposal(self, counter_proposal: Dict, user_info: Dict, red_flags: list) -> Dict:
+        """Personalize a parsed counter-proposal and attach metadata"""
+        # Personalize email template
+        email = counter_proposal.get('email_template', {})
+        if email and 'body' in email:
+            body = email['body']
+            body = body.replace('[Your Name]', user_info.get('user_name', '[Your Name]'))
+            body = body.replace('[Other Party Name]', user_info.get('other_party_name', '[Other Party Name]'))
+            body = body.replace('[Other Party]', user_info.get('other_party_name', '[Other Party]'))
+            email['body'] = body
+            counter_proposal['email_template'] = email
+        
+        # Add metadata
+        counter_proposal['proposal_metadata'] = {
+            'generated_for': user_info.get('user_name'),
+            'timestamp': self._get_timestamp(),
+            'red_flags_addressed': len(red_flags)
+        }
+        
+        return counter_proposal
+    
     def _build_prompt(self, contract_text: str, contract_type: Optional[str]) -> str:
         """Build the analysis prompt for Gemini"""
         
@@ -283,105 +674,53 @@ Return ONLY valid JSON:
         if contract_type:
             contract_type_context = f"\nContract Type: {contract_type.upper()}"
         
-        prompt = f"""You are an expert legal analyst specializing in consumer contract protection. 
-Your goal is to help ordinary people understand contracts and identify potential problems.
-
-{contract_type_context}
-
-Analyze the following contract carefully and provide a comprehensive assessment.
-
-**CRITICAL RED FLAGS TO LOOK FOR:**
-1. Hidden or excessive fees
-2. One-sided termination rights (they can terminate easily, you cannot)
-3. Automatic renewal clauses without clear opt-out
-4. Unreasonable liability waivers or indemnification
-5. Waiver of legal rights (arbitration clauses, class action waivers)
-6. Excessive penalties or damages
-7. Unfair modification rights
-8. Lack of termination rights for the consumer
-9. Unreasonable restrictions on the consumer
-10. Missing standard consumer protections
-
-**YELLOW FLAGS (Concerning but not critical):**
-1. Vague or ambiguous language
-2. Missing definitions for key terms
-3. Unusual or non-standard clauses
-4. Overly complex legal language
-5. Short notice periods
-6. Restricted dispute resolution options
-
-**ANALYSIS INSTRUCTIONS:**
-1. Read the entire contract carefully
-2. Identify ALL red flags and yellow flags
-3. For each flag, quote the EXACT problematic clause
-4. Explain the risk in simple, plain English (8th-grade reading level)
-5. Suggest specific questions the person should ask before signing
-6. Provide an overall risk score (1-10, where 10 is extremely risky)
-7. Give a clear recommendation: SIGN, NEGOTIATE, or AVOID
-
-**OUTPUT FORMAT:**
-Return your analysis as a JSON object with this EXACT structure:
-
-{{
-  "risk_score": 7,
-  "recommendation": "NEGOTIATE",
-  "overall_summary": "Brief summary of main concerns in 2-3 sentences",
-  "contract_type_detected": "rental/employment/nda/service/other",
-  
-  "red_flags": [
-    {{
-      "category": "Hidden Fees",
-      "severity": "HIGH",
-      "clause_text": "Exact quote from contract",
-      "location": "Section/Page reference if available",
-      "explanation": "Plain English explanation of why this is problematic",
-      "impact": "What could happen to you because of this clause",
-      "questions_to_ask": ["Question 1", "Question 2"]
-    }}
-  ],
-  
-  "yellow_flags": [
-    {{
-      "category": "Vague Language",
-      "severity": "MEDIUM",
-      "clause_text": "Exact quote",
-      "location": "Section/Page reference",
-      "explanation": "Why this is concerning",
-      "suggestion": "What should be clarified"
-    }}
-  ],
-  
-  "missing_protections": [
-    "Standard protection that should be included but isn't"
-  ],
-  
-  "positive_aspects": [
-    "Good clauses or protections that ARE present"
-  ],
-  
-  "key_questions_before_signing": [
-    "Question 1",
-    "Question 2",
-    "Question 3"
-  ],
-  
-  "negotiation_tips": [
-    "Specific thing to try to negotiate"
-  ]
-}}
-
-**IMPORTANT:** 
-- Be thorough but concise
-- Use friendly, accessible language
-- Focus on practical implications
-- If you find a particularly egregious clause, emphasize it strongly
-- If the contract is actually fair, say so clearly
-
-CONTRACT TEXT:
-{contract_text}
-
-Now analyze this contract and return ONLY the JSON object, with no additional text before or after."""
-
+        prompt = ANALYZE_TEMPLATE.substitute(
+            contract_type_context=contract_type_context,
+            flag_criteria=FLAG_CRITERIA,
+            contract_text=contract_text
+        )
+        
+        return prompt
+    
+    def _map_prompt(self, chunk: str, contract_type: Optional[str], index: int, total: int) -> str:
+        """Build the flags-only prompt for one chunk of a long contract"""
+        
+        contract_type_context = ""
+        if contract_type:
+            contract_type_context = f"\nContract Type: {contract_type.upper()}"
+        
+        prompt = MAP_TEMPLATE.substitute(
+            index=index,
+            total=total,
+            contract_type_context=contract_type_context,
+            flag_criteria=FLAG_CRITERIA,
+            chunk=chunk
+        )
+        
+        return prompt
+    
+    def _reduce_prompt(self, merged: Dict, contract_type: Optional[str]) -> str:
+        """Build the prompt that turns the merged chunk flags into an overall assessment"""
+        
+        contract_type_context = ""
+        if contract_type:
+            contract_type_context = f"\nContract Type: {contract_type.upper()}"
+        
+        flags = {
+            kind: [
+                {'category': f.get('category'), 'severity': f.get('severity'), 'explanation': f.get('explanation')}
+                for f in merged[kind]
+            ]
+            for kind in ('red_flags', 'yellow_flags')
+        }
+        
+        prompt = REDUCE_TEMPLATE.substitute(
+            contract_type_context=contract_type_context,
+            section_summaries=orjson.dumps(merged['section_summaries'], option=orjson.OPT_INDENT_2).decode(),
+            flags=orjson.dumps(flags, option=orjson.OPT_INDENT_2).decode(),
+            positive_aspects=orjson.dumps(merged['positive_aspects'], option=orjson.OPT_INDENT_2).decode()
+        )
+        
         return prompt
     
     def _enrich_with_community_data(self, analysis: Dict) -> Dict:
@@ -389,47 +728,163 @@ Now analyze this contract and return ONLY the JSON object, with no additional te
         enriched_flags = []
         
         for flag in analysis.get('red_flags', []):
-            category = flag.get('category', '')
-            
-            # Get community insights for this red flag
-            community_data = get_community_insights(category)
-            
-            if community_data:
-                flag['community_insights'] = {
-                    'reports': community_data['reports'],
-                    'severity': community_data['severity'],
-                    'avg_financial_impact': community_data['avg_financial_impact'],
-                    'success_rate_negotiating': community_data['success_rate_negotiating'],
-                    'avg_time_to_resolve_days': community_data['avg_time_to_resolve_days'],
-                    'user_outcomes': community_data['user_outcomes'],
-                    'tips': community_data['tips'],
-                    'success_stories': community_data['success_stories'][:2],  # Top 2 stories
-                    'warning_message': format_community_warning(community_data)
-                }
-            
-            enriched_flags.append(flag)
+            enriched_flags.append(self._enrich_flag(flag))
         
         analysis['red_flags'] = enriched_flags
         analysis['community_enhanced'] = True
         
         return analysis
     
+    def _enrich_flag(self, flag: Dict) -> Dict:
+        """Attach community insights to one red flag"""
+        category = flag.get('category', '')
+        
+        # Get community insights for this red flag
+        community_data = get_community_insights(category)
+        
+        if community_data:
+            flag['community_insights'] = {
+                **community_data,
+                'success_stories': community_data['success_stories'][:2],  # Top 2 stories
+                'warning_message': community_data.get('warning_message') or format_community_warning(community_data)
+            }
+        
+        return flag
+    
+    def _generate_parsed(self, prompt: str, kind: str, parse: Optional[Callable[[str], Dict]] = None) -> Dict:
+        """
+        Get Gemini's parsed response to a prompt
+        An identical earlier prompt is answered from the response cache
+        """
+        parse = parse or self._parse_response
+        key = self._response_cache_key(prompt, kind)
+        response_text = self._cached_response(key)
+        if response_text is not None:
+            logger.info(f"Response cache hit for {kind}")
+            return parse(response_text)
+        
+        response_text = self._generate(prompt)
+        return self._parse_and_store(key, response_text, parse)
+    
+    async def _agenerate_parsed(self, prompt: str, kind: str, parse: Optional[Callable[[str], Dict]] = None) -> Dict:
+        """Async variant of _generate_parsed"""
+        parse = parse or self._parse_response
+        key = self._response_cache_key(prompt, kind)
+        response_text = self._cached_response(key)
+        if response_text is not None:
+            logger.info(f"Response cache hit for {kind}")
+            return parse(response_text)
+        
+        response_text = await self._agenerate(prompt)
+        return self._parse_and_store(key, response_text, parse)
+    
+    def _generate(self, prompt: str) -> str:
+        """
+        Call Gemini and return the response text
+        Waits for rate-limit capacity first and retries quota errors with backoff
+        """
+        tokens = estimate_tokens(prompt)
+        for attempt in range(MAX_ATTEMPTS):
+            gemini_limiter.acquire(tokens)
+            try:
+                return self.model.generate_content(prompt).text
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                log_retry(attempt, delay, tokens)
+                time.sleep(delay)
+    
+    async def _agenerate(self, prompt: str) -> str:
+        """
+        Await Gemini, keeping at most GEMINI_MAX_CONCURRENCY calls in flight
+        Waits for rate-limit capacity first and retries quota errors with backoff
+        """
+        tokens = estimate_tokens(prompt)
+        for attempt in range(MAX_ATTEMPTS):
+            await gemini_limiter.acquire_async(tokens)
+            try:
+                async with self._gemini_slots:
+                    response = await self.model.generate_content_async(prompt)
+                    return response.text
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                log_retry(attempt, delay, tokens)
+                await asyncio.sleep(delay)
+    
+    async def _agenerate_stream(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Stream Gemini's response text as it is generated
+        Quota errors are retried only before the first chunk arrives
+        """
+        tokens = estimate_tokens(prompt)
+        for attempt in range(MAX_ATTEMPTS):
+            await gemini_limiter.acquire_async(tokens)
+            started = False
+            try:
+                async with self._gemini_slots:
+                    response = await self.model.generate_content_async(prompt, stream=True)
+                    async for chunk in response:
+                        started = True
+                        yield chunk.text
+                return
+            except Exception as e:
+                if started or not is_rate_limit_error(e) or attempt == MAX_ATTEMPTS - 1:
+                    raise
+                delay = backoff_delay(attempt)
+                log_retry(attempt, delay, tokens)
+                await asyncio.sleep(delay)
+    
+    def _response_cache_key(self, prompt: str, kind: str) -> str:
+        """Hash of everything that determines Gemini's answer"""
+        return hashlib.sha256(f"{kind}|{PROMPT_VERSION}|{MODEL_NAME}|{prompt}".encode('utf-8')).hexdigest()
+    
+    def _cached_response(self, key: str) -> Optional[str]:
+        """Look up a cached raw response"""
+        with self._response_cache_lock:
+            return self._response_cache.get(key)
+    
+    def _parse_and_store(self, key: str, response_text: str, parse: Callable[[str], Dict]) -> Dict:
+        """Parse a fresh response, caching it only if it parsed cleanly"""
+        parsed = parse(response_text)
+        if 'error' not in parsed:
+            with self._response_cache_lock:
+                self._response_cache[key] = response_text
+        return parsed
+    
+    def _load_json(self, response_text: str) -> Dict:
+        """Strip any markdown code fence from Gemini's response and decode the JSON"""
+        # Remove markdown code blocks if present
+        match = _FENCE_RE.match(response_text)
+        clean_text = match.group(1) if match else response_text.strip()
+        
+        # Fall back to the outermost object if the model wrapped it in prose
+        if not clean_text.startswith('{'):
+            match = _JSON_OBJ_RE.search(clean_text)
+            if match:
+                clean_text = match.group(0)
+        
+        return orjson.loads(clean_text)
+    
+    def _parse_map_response(self, response_text: str) -> Dict:
+        """Parse the flags found in one chunk; an unreadable chunk contributes nothing"""
+        try:
+            partial = self._load_json(response_text)
+        except orjson.JSONDecodeError as e:
+            logger.error(f"Failed to parse chunk response: {str(e)}")
+            return {'error': 'Failed to parse chunk', 'red_flags': [], 'yellow_flags': []}
+        
+        partial.setdefault('red_flags', [])
+        partial.setdefault('yellow_flags', [])
+        return partial
+    
     def _parse_response(self, response_text: str) -> Dict:
         """Parse Gemini's response and extract JSON"""
         try:
-            # Remove markdown code blocks if present
-            clean_text = response_text.strip()
-            if clean_text.startswith('```json'):
-                clean_text = clean_text[7:]
-            if clean_text.startswith('```'):
-                clean_text = clean_text[3:]
-            if clean_text.endswith('```'):
-                clean_text = clean_text[:-3]
-            
-            clean_text = clean_text.strip()
-            
             # Parse JSON
-            analysis = json.loads(clean_text)
+            analysis = self._load_json(response_text)
             
             # Validate required fields
             required_fields = ['risk_score', 'recommendation', 'overall_summary']
@@ -446,14 +901,14 @@ Now analyze this contract and return ONLY the JSON object, with no additional te
             
             # Add metadata
             analysis['analysis_metadata'] = {
-                'model': 'gemini-2.0-flash-exp',
+                'model': MODEL_NAME,
                 'timestamp': self._get_timestamp(),
                 'total_flags': len(analysis.get('red_flags', [])) + len(analysis.get('yellow_flags', []))
             }
             
             return analysis
         
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {str(e)}")
             logger.error(f"Response text: {response_text[:500]}...")
             
@@ -480,6 +935,76 @@ Now analyze this contract and return ONLY the JSON object, with no additional te
         return defaults.get(field, None)
     
     def _get_timestamp(self) -> str:
-        """Get current timestamp"""
-        from datetime import datetime
-        return datetime.utcnow().isoformat() + 'Z'
\ No newline at end of file
+        """Get current timestamp (UTC, ISO 8601 with a Z suffix)"""
+        return datetime.fromtimestamp(time.time(), tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class FlagStreamParser:
+    """
+    Incremental parser for a streamed analysis response
+    Fed text chunks as they arrive, returns each red and yellow flag as soon as
+    its object is complete. Stops once the top-level object closes, so a closing
+    fence is never parsed, and gives up quietly on malformed output; the full
+    response is validated separately once the stream ends
+    """
+    
+    def __init__(self):
+        self._red = ijson.sendable_list()
+        self._yellow = ijson.sendable_list()
+        self._events = ijson.sendable_list()
+        self._parsers = [
+            ('red_flag', self._red, ijson.items_coro(self._red, 'red_flags.item')),
+            ('yellow_flag', self._yellow, ijson.items_coro(self._yellow, 'yellow_flags.item'))
+        ]
+        # Watches for the end of the top-level object; whatever follows it
+        # (a closing ``` fence, a trailing note) is not JSON
+        self._outline = ijson.parse_coro(self._events)
+        self._head = ''
+        self._started = False
+        self._complete = False
+        self._done = False
+    
+    def feed(self, text: str) -> List[tuple]:
+        """Consume a chunk of response text and return the (type, flag) pairs it completed"""
+        if self._done:
+            return []
+        
+        if not self._started:
+            # Hold text back until any opening ```json fence can be dropped
+            self._head += text
+            start = self._head.find('{')
+            if start == -1:
+                return []
+            text = self._head[start:]
+            self._started = True
+        
+        flags = []
+        if not text:
+            # An empty send would signal end of input to ijson
+            return flags
+        
+        data = text.encode('utf-8')
+        error = None
+        
+        try:
+            self._outline.send(data)
+        except ijson.JSONError as e:
+            error = e
+        self._complete = self._complete or ('', 'end_map', None) in self._events
+        del self._events[:]
+        
+        for flag_type, found, parser in self._parsers:
+            try:
+                parser.send(data)
+            except ijson.JSONError as e:
+                error = error or e
+            # Flags completed before any error in this chunk are still good
+            flags.extend((flag_type, flag) for flag in found)
+            del found[:]
+        
+        if error is not None or self._complete:
+            if error is not None and not self._complete:
+                logger.warning(f"Stopped incremental parsing of streamed response: {str(error)}")
+            self._done = True
+        
+        return flags
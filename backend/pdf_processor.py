@@ -1,79 +1,200 @@
-import PyPDF2
-import docx
+import hashlib
+import io
 import logging
-from typing import Optional
+import os
+import re
+import threading
+import zipfile
+from cachetools import LRUCache
+from lxml import etree
+from typing import Iterator, Optional, Union
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    # Pure-Python fallback for platforms without PyMuPDF wheels; much slower.
+    # PyPDF2 is optional and not in requirements.txt, so name the real dependency
+    fitz = None
+    try:
+        import PyPDF2
+    except ImportError:
+        raise ImportError(
+            "PDF support requires pymupdf (pip install -r requirements.txt); "
+            "PyPDF2 is accepted as a slower fallback"
+        ) from None
 
 logger = logging.getLogger(__name__)
 
+# WordprocessingML elements that carry paragraph text
+_W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_P = f'{_W_NS}p'
+_W_T = f'{_W_NS}t'
+_W_TAB = f'{_W_NS}tab'
+_W_TR = f'{_W_NS}tr'
+_W_TC = f'{_W_NS}tc'
+_DOCX_TEXT_TAGS = (_W_P, _W_T, _W_TAB, f'{_W_NS}br', f'{_W_NS}cr')
+_DOCX_TABLE_TAGS = (_W_TR, _W_TC)
+_DOCX_BLOCK_TAGS = (_W_P, _W_TC, _W_TR)
+
+# Legacy copy of content (e.g. a VML text box) that Word writes alongside the
+# modern markup in mc:Choice; reading both would duplicate the text
+_MC_FALLBACK = '{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'
+
+# Text cleanup passes, compiled once
+_CRLF = re.compile(r'\r\n?')
+_BAD = re.compile(r'[\x00\ufffd]')
+_WS = re.compile(r'[^\S\n]+')  # any whitespace run except line breaks
+_LINE_EDGES = re.compile(r' ?\n ?')
+_MULTI_NL = re.compile(r'\n{3,}')
+
+# Characters that are neither alphanumeric nor whitespace (\w also admits '_')
+_UNREADABLE = re.compile(r'[^\w\s]|_')
+
+# Cleaned text of recently uploaded files, keyed on a hash of their bytes
+TEXT_CACHE_SIZE = 64
+HASH_CHUNK_SIZE = 1 << 20
+
+
 class PDFProcessor:
     """
     Handles extraction of text from various document formats
     Supports PDF, DOCX, and TXT files
     """
     
-    def extract_text_from_pdf(self, filepath: str) -> str:
+    def __init__(self):
+        # Re-uploads of the same file (retries, a different contract type) skip parsing;
+        # extraction runs in worker threads, hence the lock
+        self._text_cache = LRUCache(maxsize=TEXT_CACHE_SIZE)
+        self._text_cache_lock = threading.Lock()
+    
+    def extract_text(self, filepath: str) -> str:
+        """
+        Extract text from a PDF or DOCX file on disk, reusing the result for identical files
+        
+        Args:
+            filepath: Path to the file; its extension selects the parser
+        
+        Returns:
+            Extracted text as string
+        """
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        
+        extension = os.path.splitext(filepath)[1].lstrip('.').lower()
+        return self._extract_cached(digest.hexdigest(), extension, filepath)
+    
+    def extract_text_cached(self, file_bytes: bytes, extension: str) -> str:
+        """
+        Extract text from an in-memory PDF or DOCX upload, reusing the result for identical bytes
+        
+        Args:
+            file_bytes: Raw file contents
+            extension: 'pdf' or 'docx'
+        
+        Returns:
+            Extracted text as string
+        """
+        return self._extract_cached(hashlib.sha256(file_bytes).hexdigest(), extension, file_bytes)
+    
+    def extract_text_from_pdf(self, source: Union[str, bytes]) -> str:
         """
         Extract text from a PDF file
         
         Args:
-            filepath: Path to the PDF file
+            source: Path to the PDF file, or its raw bytes (in-memory upload)
         
         Returns:
             Extracted text as string
         """
         try:
-            text = ""
-            with open(filepath, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                num_pages = len(pdf_reader.pages)
-                
-                logger.info(f"Processing PDF with {num_pages} pages")
-                
-                for page_num in range(num_pages):
-                    page = pdf_reader.pages[page_num]
-                    page_text = page.extract_text()
-                    
-                    # Add page separator for context
-                    text += f"\n--- Page {page_num + 1} ---\n"
-                    text += page_text
-                
-                # Clean up the text
-                text = self._clean_text(text)
-                
-                logger.info(f"Extracted {len(text)} characters from PDF")
-                
-                return text
+            parts = []
+            for page_num, page_text in enumerate(self._iter_pdf_pages(source)):
+                # Add page separator for context
+                parts.append(f"\n--- Page {page_num + 1} ---\n")
+                parts.append(page_text)
+            
+            # Clean up the text
+            text = self._clean_text(''.join(parts))
+            
+            logger.info(f"Extracted {len(text)} characters from PDF")
+            
+            return text
         
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {str(e)}")
             raise Exception(f"Failed to process PDF: {str(e)}")
     
-    def extract_text_from_docx(self, filepath: str) -> str:
+    def extract_text_from_docx(self, source: Union[str, bytes]) -> str:
         """
         Extract text from a DOCX file
         
         Args:
-            filepath: Path to the DOCX file
+            source: Path to the DOCX file, or its raw bytes (in-memory upload)
         
         Returns:
             Extracted text as string
         """
         try:
-            doc = docx.Document(filepath)
-            text = ""
+            parts = []
+            
+            # Open paragraphs, table cells and rows, innermost last, each with the
+            # text collected so far. A stack because they nest: tables inside cells,
+            # text boxes (whole paragraphs) inside a paragraph's runs
+            blocks = []
+            fallback_depth = 0
             
-            # Extract paragraphs
-            for i, paragraph in enumerate(doc.paragraphs):
-                if paragraph.text.strip():
-                    text += paragraph.text + "\n"
+            # Stream word/document.xml straight out of the archive instead of
+            # building python-docx's full object model just to read text
+            with zipfile.ZipFile(io.BytesIO(source) if isinstance(source, bytes) else source) as archive:
+                with archive.open('word/document.xml') as document_xml:
+                    # Uploads are untrusted: never resolve entities or fetch DTDs, or a
+                    # crafted document could pull local files into the prompt (XXE)
+                    for event, element in etree.iterparse(
+                        document_xml, events=('start', 'end'),
+                        tag=_DOCX_TEXT_TAGS + _DOCX_TABLE_TAGS + (_MC_FALLBACK,),
+                        resolve_entities=False, load_dtd=False, no_network=True
+                    ):
+                        if element.tag == _MC_FALLBACK:
+                            fallback_depth += 1 if event == 'start' else -1
+                            if event == 'end':
+                                element.clear()
+                            continue
+                        if fallback_depth:
+                            continue
+                        
+                        if event == 'start':
+                            if element.tag in _DOCX_BLOCK_TAGS:
+                                blocks.append((element.tag, []))
+                            continue
+                        
+                        if element.tag in _DOCX_BLOCK_TAGS:
+                            tag, pieces = blocks.pop()
+                            # Runs of a paragraph are concatenated; paragraphs within a
+                            # cell and cells within a row are joined with spaces
+                            text = ''.join(pieces) if tag == _W_P else ' '.join(pieces)
+                            element.clear()
+                            
+                            if not text.strip():
+                                continue
+                            if not blocks:
+                                parts.append(text + "\n")
+                            elif blocks[-1][0] == _W_P:
+                                # A text box: keep it inline in the surrounding paragraph
+                                blocks[-1][1].append(f" {text.strip()} ")
+                            else:
+                                blocks[-1][1].append(text.strip())
+                        elif blocks and blocks[-1][0] == _W_P:
+                            if element.tag == _W_T:
+                                if element.text:
+                                    blocks[-1][1].append(element.text)
+                            elif element.tag == _W_TAB:
+                                blocks[-1][1].append("\t")
+                            else:
+                                blocks[-1][1].append("\n")
             
-            # Extract tables if any
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            text += cell.text + " "
-                    text += "\n"
+            text = ''.join(parts)
             
             # Clean up the text
             text = self._clean_text(text)
@@ -86,6 +207,45 @@ class PDFProcessor:
             logger.error(f"Error extracting text from DOCX: {str(e)}")
             raise Exception(f"Failed to process DOCX: {str(e)}")
     
+    def _extract_cached(self, digest: str, extension: str, source: Union[str, bytes]) -> str:
+        """Return cached text for a file hash, or run the extractor for its type and cache the result"""
+        key = (digest, extension)
+        with self._text_cache_lock:
+            text = self._text_cache.get(key)
+        if text is not None:
+            logger.info(f"Text cache hit for {extension.upper()} upload")
+            return text
+        
+        if extension == 'pdf':
+            text = self.extract_text_from_pdf(source)
+        elif extension == 'docx':
+            text = self.extract_text_from_docx(source)
+        else:
+            raise ValueError(f"Unsupported file type: {extension}")
+        
+        with self._text_cache_lock:
+            self._text_cache[key] = text
+        return text
+    
+    def _iter_pdf_pages(self, source: Union[str, bytes]) -> Iterator[str]:
+        """Yield the text of each page, from a path or from bytes already held in memory"""
+        if fitz is None:
+            pdf_reader = PyPDF2.PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+            logger.info(f"Processing PDF with {len(pdf_reader.pages)} pages (PyPDF2)")
+            for page in pdf_reader.pages:
+                yield page.extract_text() or ""
+            return
+        
+        if isinstance(source, bytes):
+            pdf_doc = fitz.open(stream=source, filetype="pdf")
+        else:
+            pdf_doc = fitz.open(source)
+        
+        with pdf_doc:
+            logger.info(f"Processing PDF with {pdf_doc.page_count} pages")
+            for page in pdf_doc:
+                yield page.get_text("text")
+    
     def _clean_text(self, text: str) -> str:
         """
         Clean extracted text
@@ -99,20 +259,18 @@ class PDFProcessor:
         Returns:
             Cleaned text
         """
-        # Replace multiple spaces with single space
-        text = ' '.join(text.split())
-        
         # Normalize line breaks
-        text = text.replace('\r\n', '\n')
-        text = text.replace('\r', '\n')
-        
-        # Remove multiple consecutive line breaks
-        while '\n\n\n' in text:
-            text = text.replace('\n\n\n', '\n\n')
+        text = _CRLF.sub('\n', text)
         
         # Remove null bytes and other problematic characters
-        text = text.replace('\x00', '')
-        text = text.replace('\ufffd', '')
+        text = _BAD.sub('', text)
+        
+        # Collapse spaces within each line, keeping the line breaks themselves
+        text = _WS.sub(' ', text)
+        text = _LINE_EDGES.sub('\n', text)
+        
+        # Remove multiple consecutive line breaks
+        text = _MULTI_NL.sub('\n\n', text)
         
         return text.strip()
     
@@ -131,7 +289,7 @@ class PDFProcessor:
             return False
         
         # Check if text is mostly readable (not just garbage characters)
-        alphanumeric_count = sum(c.isalnum() or c.isspace() for c in text)
+        alphanumeric_count = len(text) - len(_UNREADABLE.findall(text))
         if alphanumeric_count / len(text) < 0.5:
             logger.warning("Text appears to contain mostly non-readable characters")
             return False
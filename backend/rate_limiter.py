@@ -0,0 +1,105 @@
+"""
+Client-side rate limiting for Gemini
+Token buckets for requests per minute and tokens per minute, shared by the
+sync and async call paths, plus backoff helpers for quota (429) errors
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+logger = logging.getLogger(__name__)
+
+GEMINI_RPM = int(os.environ.get('GEMINI_RPM', 1800))
+GEMINI_TPM = int(os.environ.get('GEMINI_TPM', 3_500_000))
+# The limits are per container; each server worker process gets an equal share
+WORKER_PROCESSES = max(1, int(os.environ.get('WEB_CONCURRENCY', 1)))
+
+MAX_ATTEMPTS = 5
+MAX_BACKOFF_SECONDS = 60
+
+
+class RateLimiter:
+    """
+    Request and token buckets refilled continuously at their per-minute rates
+    Callers reserve capacity up front; if a bucket runs dry the reservation
+    goes into debt and the caller waits until the refill would have covered it
+    """
+    
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self, tokens: int) -> None:
+        """Block until one request of `tokens` tokens may be sent"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+    
+    async def acquire_async(self, tokens: int) -> None:
+        """Wait without blocking the event loop until one request may be sent"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    def _reserve(self, tokens: int) -> float:
+        """Take capacity from both buckets and return the seconds to wait before sending"""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+            
+            # A prompt larger than a whole minute's budget still gets through eventually
+            self._requests -= 1
+            self._tokens -= min(tokens, self.tpm)
+            
+            wait = max(0.0, -self._requests * 60 / self.rpm, -self._tokens * 60 / self.tpm)
+        
+        if wait > 0:
+            logger.info(json.dumps({'event': 'gemini_throttle', 'wait_s': round(wait, 2), 'tokens': tokens}))
+        return wait
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for quota purposes (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for Gemini quota errors (HTTP 429 / RESOURCE_EXHAUSTED)"""
+    return isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests))
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for the given zero-based attempt"""
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt + random.random())
+
+
+def log_retry(attempt: int, delay: float, tokens: int) -> None:
+    """Emit a structured log line for a rate-limited Gemini call"""
+    logger.warning(json.dumps({
+        'event': 'gemini_retry',
+        'attempt': attempt + 1,
+        'wait_s': round(delay, 2),
+        'tokens': tokens
+    }))
+
+
+# Shared by every ContractAnalyzer in the process
+gemini_limiter = RateLimiter(
+    max(1, GEMINI_RPM // WORKER_PROCESSES),
+    max(1, GEMINI_TPM // WORKER_PROCESSES)
+)
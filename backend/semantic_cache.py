@@ -0,0 +1,130 @@
+"""
+Semantic cache for contract analyses
+Reuses a past analysis when a new contract is nearly identical to one already
+analyzed (e.g. the same lease with a different tenant name)
+Enabled with SEMANTIC_CACHE=1; requires sentence-transformers
+"""
+
+import copy
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384
+SIMILARITY_THRESHOLD = 0.87
+MAX_ENTRIES = 512
+MAX_EMBED_CHARS = 4000  # leading slice of the contract that gets embedded
+EMBED_BATCH_SIZE = 32
+
+# Loaded models shared by every SemanticCache in the process, keyed on model name
+_EMBEDDERS = {}
+_EMBEDDERS_LOCK = threading.Lock()
+
+
+def _get_embedder(model_name: str = EMBEDDING_MODEL):
+    """Load the sentence-transformer on first use; later calls reuse it"""
+    with _EMBEDDERS_LOCK:
+        embedder = _EMBEDDERS.get(model_name)
+        if embedder is None:
+            from sentence_transformers import SentenceTransformer
+            embedder = _EMBEDDERS[model_name] = SentenceTransformer(model_name)
+            logger.info(f"Semantic cache loaded embedding model {model_name}")
+        return embedder
+
+
+class SemanticCache:
+    """
+    Fixed-size store of (embedding, analysis) pairs searched by cosine similarity
+    Embeddings are normalized, so similarity is a single matrix-vector product;
+    when full, the least recently used entry is replaced
+    """
+    
+    def __init__(self, max_entries: int = MAX_ENTRIES, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        
+        # Preallocated so adding an entry never reallocates the matrix
+        self._vectors = np.zeros((max_entries, EMBEDDING_DIM), dtype=np.float32)
+        self._contract_types = [None] * max_entries
+        self._analyses = [None] * max_entries
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._size = 0
+        self._clock = 0
+    
+    def embed(self, contract_text: str) -> np.ndarray:
+        """Embed the leading part of a contract as a normalized vector"""
+        return self.embed_many([contract_text])[0]
+    
+    def embed_many(self, contract_texts: List[str]) -> np.ndarray:
+        """Embed several contracts in one batched forward pass; returns one row per contract"""
+        return _get_embedder().encode(
+            [text[:MAX_EMBED_CHARS] for text in contract_texts],
+            batch_size=EMBED_BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+    
+    def lookup(self, vector: np.ndarray, contract_type: Optional[str]) -> Optional[Dict]:
+        """
+        Find the stored analysis most similar to vector
+        
+        Returns:
+            A copy of the analysis if its similarity reaches the threshold, else None
+        """
+        return self.lookup_many(vector[np.newaxis], contract_type)[0]
+    
+    def lookup_many(self, vectors: np.ndarray, contract_type: Optional[str]) -> List[Optional[Dict]]:
+        """Look up a batch of vectors with a single matrix product; one result per row"""
+        with self._lock:
+            if self._size == 0:
+                return [None] * len(vectors)
+            
+            sims = vectors @ self._vectors[:self._size].T
+            other_type = np.array([stored_type != contract_type for stored_type in self._contract_types[:self._size]])
+            sims[:, other_type] = -1.0
+            
+            best = sims.argmax(axis=1)
+            best_sims = sims[np.arange(len(vectors)), best]
+            
+            results = []
+            for slot, similarity in zip(best.tolist(), best_sims.tolist()):
+                if similarity < self.threshold:
+                    results.append(None)
+                    continue
+                
+                self._clock += 1
+                self._last_used[slot] = self._clock
+                logger.info(f"Semantic cache hit (similarity {similarity:.3f})")
+                results.append(copy.deepcopy(self._analyses[slot]))
+            
+            return results
+    
+    def add(self, vector: np.ndarray, contract_type: Optional[str], analysis: Dict) -> None:
+        """Store an analysis, evicting the least recently used entry when full"""
+        self.add_many(vector[np.newaxis], contract_type, [analysis])
+    
+    def add_many(self, vectors: np.ndarray, contract_type: Optional[str], analyses: List[Dict]) -> None:
+        """Store a batch of analyses, filling free slots first and then evicting least recently used"""
+        capacity = len(self._vectors)
+        vectors = vectors[-capacity:]
+        analyses = analyses[-capacity:]
+        
+        with self._lock:
+            free = min(len(analyses), capacity - self._size)
+            slots = list(range(self._size, self._size + free))
+            if len(analyses) > free:
+                # Only entries that were already stored are candidates for eviction
+                slots += np.argsort(self._last_used[:self._size])[:len(analyses) - free].tolist()
+            self._size += free
+            
+            self._vectors[slots] = vectors
+            for slot, analysis in zip(slots, analyses):
+                self._clock += 1
+                self._contract_types[slot] = contract_type
+                self._analyses[slot] = copy.deepcopy(analysis)
+                self._last_used[slot] = self._clock
@@ -0,0 +1,84 @@
+"""
+Tests for FlagStreamParser's incremental flag extraction
+Run from backend/: python -m unittest discover tests
+"""
+
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from contract_analyzer import FlagStreamParser
+
+RED_FLAGS = [
+    {'category': 'Late Fees', 'clause_text': 'A fee of $150 applies after day 3'},
+    {'category': 'Formatting', 'clause_text': 'Quoted as ```code``` in the lease', 'note': 'has a ` and a ``'},
+]
+YELLOW_FLAGS = [
+    {'category': 'Vague Terms', 'clause_text': 'Reasonable wear, e.g. ```scuffs```'},
+]
+RESPONSE = json.dumps({
+    'risk_score': 7,
+    'red_flags': RED_FLAGS,
+    'yellow_flags': YELLOW_FLAGS,
+    'overall_summary': 'Summary mentioning ``` after the flags',
+}, indent=2)
+
+
+def random_chunks(text: str, rng: random.Random) -> list:
+    """Split text into chunks of 1 to 12 characters"""
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 12)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def feed_all(chunks) -> list:
+    """Feed every chunk to a fresh parser and collect what it returns"""
+    parser = FlagStreamParser()
+    flags = []
+    for chunk in chunks:
+        flags.extend(parser.feed(chunk))
+    return flags
+
+
+class FlagStreamParserTest(unittest.TestCase):
+
+    def expected(self):
+        return [('red_flag', flag) for flag in RED_FLAGS] + [('yellow_flag', flag) for flag in YELLOW_FLAGS]
+
+    def test_fenced_response_in_random_chunks(self):
+        rng = random.Random(1234)
+        text = f'```json\n{RESPONSE}\n```\n'
+        for _ in range(200):
+            self.assertEqual(feed_all(random_chunks(text, rng)), self.expected())
+
+    def test_bare_response_with_trailing_text(self):
+        rng = random.Random(99)
+        text = f'{RESPONSE}\nLet me know if you need anything else.'
+        for _ in range(50):
+            self.assertEqual(feed_all(random_chunks(text, rng)), self.expected())
+
+    def test_single_chunk(self):
+        self.assertEqual(feed_all([f'```json\n{RESPONSE}\n```']), self.expected())
+
+    def test_malformed_response_keeps_earlier_flags(self):
+        text = RESPONSE[:RESPONSE.index('"yellow_flags"')] + '"yellow_flags": [{"category": oops'
+        with self.assertLogs('contract_analyzer', level='WARNING'):
+            flags = feed_all(random_chunks(text, random.Random(7)))
+        self.assertEqual(flags, [('red_flag', flag) for flag in RED_FLAGS])
+
+    def test_nothing_returned_after_stopping(self):
+        parser = FlagStreamParser()
+        parser.feed(RESPONSE)
+        self.assertEqual(parser.feed('{"red_flags": [{"category": "Extra"}]}'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for PDFProcessor's DOCX text extraction and PDF backend import
+Run from backend/: python -m unittest discover tests
+"""
+
+import importlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_processor import PDFProcessor
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+MC_NS = 'http://schemas.openxmlformats.org/markup-compatibility/2006'
+
+
+def make_docx(body: str, prolog: str = '') -> bytes:
+    """Build a minimal DOCX whose document.xml wraps body"""
+    document_xml = (
+        f'<?xml version="1.0" encoding="UTF-8"?>{prolog}'
+        f'<w:document xmlns:w="{W_NS}" xmlns:mc="{MC_NS}"><w:body>{body}</w:body></w:document>'
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('word/document.xml', document_xml)
+    return buffer.getvalue()
+
+
+def paragraph(*runs: str) -> str:
+    """A w:p with one w:r/w:t per run"""
+    return '<w:p>' + ''.join(f'<w:r><w:t xml:space="preserve">{run}</w:t></w:r>' for run in runs) + '</w:p>'
+
+
+def cell(*paragraphs: str) -> str:
+    """A w:tc holding the given paragraph markup"""
+    return '<w:tc>' + ''.join(paragraphs) + '</w:tc>'
+
+
+def row(*cells: str) -> str:
+    """A w:tr holding the given cell markup"""
+    return '<w:tr>' + ''.join(cells) + '</w:tr>'
+
+
+def table(*rows: str) -> str:
+    """A w:tbl holding the given row markup"""
+    return '<w:tbl>' + ''.join(rows) + '</w:tbl>'
+
+
+def text_box(*paragraphs: str) -> str:
+    """A run holding a text box, with the legacy fallback copy Word also writes"""
+    content = '<w:txbxContent>' + ''.join(paragraphs) + '</w:txbxContent>'
+    return (
+        '<w:r><mc:AlternateContent>'
+        f'<mc:Choice Requires="wps"><w:drawing>{content}</w:drawing></mc:Choice>'
+        f'<mc:Fallback><w:pict>{content}</w:pict></mc:Fallback>'
+        '</mc:AlternateContent></w:r>'
+    )
+
+
+class DocxExtractionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.processor = PDFProcessor()
+
+    def test_paragraphs(self):
+        docx = make_docx(paragraph('First clause.') + paragraph('Second ', 'clause.'))
+        self.assertEqual(self.processor.extract_text_from_docx(docx), 'First clause.\nSecond clause.')
+
+    def test_table_rows_are_one_line_each(self):
+        docx = make_docx(
+            paragraph('Fees:')
+            + table(
+                row(cell(paragraph('Late fee')), cell(paragraph('$150'), paragraph('per month'))),
+                row(cell(paragraph('Deposit')), cell(paragraph(''))),
+            )
+            + paragraph('End.')
+        )
+        self.assertEqual(
+            self.processor.extract_text_from_docx(docx),
+            'Fees:\nLate fee $150 per month\nDeposit\nEnd.'
+        )
+
+    def test_nested_table_folds_into_its_cell(self):
+        inner = table(row(cell(paragraph('A')), cell(paragraph('B'))))
+        docx = make_docx(table(row(cell(paragraph('Outer')), cell(paragraph('Before'), inner))))
+        self.assertEqual(self.processor.extract_text_from_docx(docx), 'Outer Before A B')
+
+    def test_text_box_stays_inline_and_is_not_duplicated(self):
+        body = (
+            '<w:p><w:r><w:t xml:space="preserve">The tenant shall pay </w:t></w:r>'
+            + text_box(paragraph('BOX'))
+            + '<w:r><w:t xml:space="preserve"> rent monthly.</w:t></w:r></w:p>'
+            + paragraph('Next clause.')
+        )
+        self.assertEqual(
+            self.processor.extract_text_from_docx(make_docx(body)),
+            'The tenant shall pay BOX rent monthly.\nNext clause.'
+        )
+
+    def test_external_entities_are_not_resolved(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as secret:
+            secret.write('TOPSECRET-CONTENTS')
+        self.addCleanup(os.unlink, secret.name)
+
+        prolog = f'<!DOCTYPE w:document [<!ENTITY xxe SYSTEM "file://{secret.name}">]>'
+        docx = make_docx(paragraph('Hello &xxe; world'), prolog)
+
+        text = self.processor.extract_text_from_docx(docx)
+        self.assertNotIn('TOPSECRET', text)
+        self.assertTrue(text.startswith('Hello'))
+
+
+class PdfBackendImportTest(unittest.TestCase):
+
+    def test_missing_backends_name_pymupdf(self):
+        # None in sys.modules makes the import raise ImportError
+        with mock.patch.dict(sys.modules, {'fitz': None, 'PyPDF2': None}):
+            del sys.modules['pdf_processor']
+            with self.assertRaisesRegex(ImportError, 'pymupdf'):
+                importlib.import_module('pdf_processor')
+
+
+if __name__ == '__main__':
+    unittest.main()
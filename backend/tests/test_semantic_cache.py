@@ -0,0 +1,130 @@
+"""
+Tests for SemanticCache's batched lookup and eviction, and ContractAnalyzer's batch path
+Run from backend/: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GEMINI_API_KEY', 'test-key')
+
+import semantic_cache
+from contract_analyzer import ContractAnalyzer
+from semantic_cache import EMBEDDING_DIM, EMBEDDING_MODEL, SemanticCache
+
+
+def unit(index: int) -> np.ndarray:
+    """A normalized embedding; distinct indices are orthogonal"""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    vector[index] = 1.0
+    return vector
+
+
+def batch(*indices: int) -> np.ndarray:
+    """One unit embedding per index, stacked into rows"""
+    return np.stack([unit(i) for i in indices])
+
+
+class FakeEmbedder:
+    """Stands in for the sentence-transformer: contracts sharing their first word embed identically"""
+
+    def __init__(self):
+        self.indices = {}
+
+    def encode(self, texts, **kwargs):
+        return batch(*[self.indices.setdefault(text.split()[0], len(self.indices)) for text in texts])
+
+
+class SemanticCacheTest(unittest.TestCase):
+
+    def stored(self, cache, indices, contract_type='rental'):
+        """Which of the given embeddings are hits, looked up together"""
+        return [result is not None for result in cache.lookup_many(batch(*indices), contract_type)]
+
+    def test_batch_larger_than_free_slots_evicts_least_recently_used(self):
+        cache = SemanticCache(max_entries=4)
+        cache.add_many(batch(0, 1, 2), 'rental', [{'id': 0}, {'id': 1}, {'id': 2}])
+        cache.lookup(unit(0), 'rental')  # 1 is now the least recently used
+
+        cache.add_many(batch(3, 4), 'rental', [{'id': 3}, {'id': 4}])
+
+        self.assertEqual(self.stored(cache, [0, 1, 2, 3, 4]), [True, False, True, True, True])
+
+    def test_batch_larger_than_capacity_keeps_its_last_entries(self):
+        cache = SemanticCache(max_entries=3)
+        cache.add(unit(0), 'rental', {'id': 0})
+
+        cache.add_many(batch(1, 2, 3, 4, 5), 'rental', [{'id': i} for i in range(1, 6)])
+
+        self.assertEqual(self.stored(cache, [0, 1, 2, 3, 4, 5]), [False, False, False, True, True, True])
+        self.assertEqual(cache.lookup(unit(5), 'rental'), {'id': 5})
+
+    def test_other_contract_type_is_never_a_hit(self):
+        cache = SemanticCache(max_entries=4)
+        cache.add(unit(0), 'rental', {'id': 0})
+        cache.add(unit(1), None, {'id': 1})
+
+        self.assertIsNone(cache.lookup(unit(0), 'employment'))
+        self.assertIsNone(cache.lookup(unit(0), None))
+        self.assertIsNone(cache.lookup(unit(1), 'rental'))
+        self.assertEqual(cache.lookup_many(batch(0, 1), 'rental'), [{'id': 0}, None])
+        self.assertEqual(cache.lookup_many(batch(0, 1), None), [None, {'id': 1}])
+
+    def test_lookup_returns_a_copy(self):
+        cache = SemanticCache(max_entries=2)
+        cache.add(unit(0), 'rental', {'red_flags': []})
+        cache.lookup(unit(0), 'rental')['red_flags'].append('changed')
+        self.assertEqual(cache.lookup(unit(0), 'rental'), {'red_flags': []})
+
+
+class AnalyzeBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        semantic_cache._EMBEDDERS[EMBEDDING_MODEL] = FakeEmbedder()
+        self.addCleanup(semantic_cache._EMBEDDERS.pop, EMBEDDING_MODEL)
+
+        self.analyzer = ContractAnalyzer()
+        self.analyzer._semantic_cache = SemanticCache(max_entries=8)
+        self.fresh_calls = []
+        self.analyzer._analyze_fresh = self.fake_analyze
+
+    def fake_analyze(self, contract_text, contract_type):
+        self.fresh_calls.append(contract_text)
+        if contract_text.startswith('broken'):
+            return {'error': 'Failed to parse analysis', 'red_flags': [], 'yellow_flags': []}
+        return {'summary': contract_text, 'red_flags': [], 'yellow_flags': []}
+
+    def test_batch_mixing_hits_and_misses(self):
+        self.analyzer.analyze_batch(['alpha lease for Ann', 'beta lease for Bob'], 'rental')
+        self.fresh_calls.clear()
+
+        results = self.analyzer.analyze_batch(
+            ['alpha lease for Cid', 'gamma lease for Dee', 'beta lease for Eve', 'broken lease'], 'rental'
+        )
+
+        # Only the misses go to Gemini (concurrently, so in any order); hits come
+        # back as the stored analysis, and results keep the batch's order
+        self.assertCountEqual(self.fresh_calls, ['gamma lease for Dee', 'broken lease'])
+        self.assertEqual(
+            [result.get('summary') for result in results],
+            ['alpha lease for Ann', 'gamma lease for Dee', 'beta lease for Bob', None]
+        )
+
+        # Fresh results are cached, except the failed one
+        self.fresh_calls.clear()
+        self.analyzer.analyze_batch(['gamma lease again', 'broken lease'], 'rental')
+        self.assertEqual(self.fresh_calls, ['broken lease'])
+
+    def test_batch_of_another_type_misses(self):
+        self.analyzer.analyze_batch(['alpha lease'], 'rental')
+        self.fresh_calls.clear()
+        self.analyzer.analyze_batch(['alpha lease'], 'employment')
+        self.assertEqual(self.fresh_calls, ['alpha lease'])
+
+
+if __name__ == '__main__':
+    unittest.main()